@@ -1,16 +1,26 @@
-# from Cryptography.AES128.galois import GF8, xtime
-from galois import GF8, xtime
+# from Cryptography.AES128.galois import xtime
+from galois import xtime
+from tables import S_BOX as _S_BOX, INV_S_BOX as _INV_S_BOX, XTIME as _XTIME
+from tables import TE0 as _TE0, TE1 as _TE1, TE2 as _TE2, TE3 as _TE3
+from tables import TD0 as _TD0, TD1 as _TD1, TD2 as _TD2, TD3 as _TD3
+import io
+import threading
+from collections import OrderedDict
 from os import urandom
+from struct import pack, unpack
+
+np = None   # NumPy is imported on the first vectorized call (see _load_numpy), the path is optional
 
 Nb = 4
 Nk = 4
 Nr = 10
 LENGTH = 16
-
-
-# cyclic right rotation of x (1 byte) by y bits
-def _rotr(x, y):
-    return ((x >> y) | (x << (8 - y))) & 0xff
+VECTOR_THRESHOLD = 1024          # messages of at least this many bytes go through the NumPy path
+VECTOR_CHUNK = 1 << 20           # bytes processed by one vectorized call (bounds temporary arrays)
+STREAM_CHUNK = 1 << 20           # bytes read at once by process_stream
+PARALLEL_SEGMENT = 1 << 22       # bytes processed by one task of encode_parallel / decode_parallel
+KEYSTREAM_CACHE_SIZE = 1 << 24   # default memory cap of KeystreamCache in bytes
+KEY_CACHE_SIZE = 256             # number of expanded keys kept by _get_schedule (0 - no caching)
 
 
 # xor of w = [w0, w1, w2, w3], v = [v0, v1, v2, v3], where w_i and v_j are 1 byte
@@ -18,30 +28,17 @@ def _xor_words(w, v):
     return [w[i] ^ v[i] for i in range(len(w))]
 
 
-# ============= S-BOX ==============
-# S-box: substitution values for the byte  (needed for SubBytes)
-def _get_s_box():
-    box = []
-    c = GF8(0x63)
-    for i in range(2 ** 8):
-        el = GF8(i).inv().value
-        box.append(c.value ^ el ^ _rotr(el, 4) ^ _rotr(el, 5) ^ _rotr(el, 6) ^ _rotr(el, 7))
-    return box
+# xor of byte strings w and v, the result has length of w (v should be at least as long as w)
+def _xor_bytes(w, v):
+    n = len(w)
+    return (int.from_bytes(w, 'big') ^ int.from_bytes(v[:n], 'big')).to_bytes(n, 'big')
 
 
-# Inverse S-box: substitution values for the byte  (needed for Inverse SubBytes)
-def _get_inv_s_box():
-    c = GF8(0x5)
-    inv_box = []
-    for i in range(2 ** 8):
-        el = c + (_rotr(i, 7) ^ _rotr(i, 2) ^ _rotr(i, 5))
-        inv_box.append(el.inv().value)
-    return inv_box
-
-
-# obtain S_box and Inv_S_box
-_S_BOX = tuple(_get_s_box())
-_INV_S_BOX = tuple(_get_inv_s_box())
+# ============= LOOKUP TABLES ==============
+# S-box, inverse S-box, xtime and T-tables are precomputed by gen_tables.py
+# T-tables merge SubBytes, ShiftRows and MixColumns of one round into 4 lookups per column
+# (see Sec 4.2 in The Design of Rijndael - implementation on 32-bit processors).
+# Column of the state is kept as a 32-bit big-endian word: s[0,c] || s[1,c] || s[2,c] || s[3,c]
 
 
 # ============= EXPANDING KEY ==============
@@ -69,6 +66,65 @@ def _key_expansion(cipher_key):
     return keys
 
 
+def _pack_keys(keys):
+    """
+    pack expanded key (list of 4-byte words) into 32-bit integers
+    :return: (encryption schedule, decryption schedule) - both in the order the rounds use them
+    """
+    ek = [w[0] << 24 | w[1] << 16 | w[2] << 8 | w[3] for w in keys]
+    # decryption with T-tables is the equivalent inverse cipher (Sec 5.3.5 of FIPS-197):
+    # round keys are taken in reverse order and InvMixColumns is applied to the inner ones.
+    # Td_i[S[x]] is exactly InvMixColumns applied to a single byte x in row i
+    dk = ek[Nr * Nb:]
+    for i in range(Nr - 1, 0, -1):
+        for w in ek[i * Nb:(i + 1) * Nb]:
+            dk.append(_TD0[_S_BOX[w >> 24]] ^ _TD1[_S_BOX[(w >> 16) & 0xff]] ^
+                      _TD2[_S_BOX[(w >> 8) & 0xff]] ^ _TD3[_S_BOX[w & 0xff]])
+    dk += ek[:Nb]
+    return ek, dk
+
+
+def _schedule(keys):
+    """
+    all forms of the expanded key the engines need, computed once:
+    (expanded key, packed encryption schedule, packed decryption schedule)
+    """
+    keys = tuple(tuple(w) for w in keys)   # shared between all AES objects with the same key
+    ek, dk = _pack_keys(keys)
+    return keys, tuple(ek), tuple(dk)
+
+
+# process-wide LRU cache: cipher key -> _schedule(_key_expansion(cipher key))
+_key_cache = OrderedDict()
+_key_cache_lock = threading.Lock()
+
+
+def _get_schedule(cipher_key):
+    cipher_key = bytes(cipher_key)
+    with _key_cache_lock:
+        schedule = _key_cache.get(cipher_key)
+        if schedule is not None:
+            _key_cache.move_to_end(cipher_key)
+            return schedule
+    schedule = _schedule(_key_expansion(cipher_key))
+    with _key_cache_lock:
+        _key_cache[cipher_key] = schedule
+        while len(_key_cache) > KEY_CACHE_SIZE:
+            _key_cache.popitem(last=False)
+    return schedule
+
+
+def clear_key_cache(cipher_key=None):
+    """
+    drop expanded key of *cipher_key* from the cache (or all of them if cipher_key is None)
+    """
+    with _key_cache_lock:
+        if cipher_key is None:
+            _key_cache.clear()
+        else:
+            _key_cache.pop(bytes(cipher_key), None)
+
+
 # ============= S BYTES ==============
 def _sub_bytes(S):
     for i in range(4):
@@ -139,6 +195,116 @@ def _add_round_key(cipher_key, S):
             S[j][i] = S[j][i] ^ cipher_key[i][j]
 
 
+# ============= VECTORIZED (NumPy) =============
+# Same round functions as above, but applied to N blocks at once:
+# blocks are stored as (N, 16) uint8 array, byte 4 * c + r of a block is s[r, c]
+_numpy_checked = False
+
+
+def _load_numpy():
+    """
+    import NumPy and build its tables on the first call (importing it takes longer than the whole aes module)
+    :return: True if the vectorized path is available
+    """
+    global np, _numpy_checked, _S_BOX_NP, _INV_S_BOX_NP, _XTIME_NP, _SHIFT_ROWS_NP, _INV_SHIFT_ROWS_NP
+    if not _numpy_checked:
+        try:
+            import numpy
+        except ImportError:     # vectorized multi-block path is optional
+            numpy = None
+        if numpy is not None:
+            _S_BOX_NP = numpy.array(_S_BOX, dtype=numpy.uint8)
+            _INV_S_BOX_NP = numpy.array(_INV_S_BOX, dtype=numpy.uint8)
+            _XTIME_NP = numpy.array(_XTIME, dtype=numpy.uint8)
+            _SHIFT_ROWS_NP = numpy.array([4 * ((i // 4 + i % 4) % 4) + i % 4 for i in range(LENGTH)])
+            _INV_SHIFT_ROWS_NP = numpy.array([4 * ((i // 4 - i % 4) % 4) + i % 4 for i in range(LENGTH)])
+            np = numpy
+        _numpy_checked = True
+    return np is not None
+
+
+def _mix_columns_np(S):
+    # S has shape (N, 4, 4): block, column, row
+    xt = _XTIME_NP
+    a0, a1, a2, a3 = S[:, :, 0], S[:, :, 1], S[:, :, 2], S[:, :, 3]
+    t = a0 ^ a1 ^ a2 ^ a3
+    res = np.empty_like(S)
+    res[:, :, 0] = a0 ^ t ^ xt[a0 ^ a1]
+    res[:, :, 1] = a1 ^ t ^ xt[a1 ^ a2]
+    res[:, :, 2] = a2 ^ t ^ xt[a2 ^ a3]
+    res[:, :, 3] = a3 ^ t ^ xt[a3 ^ a0]
+    return res
+
+
+def _inv_mix_columns_np(S):
+    xt = _XTIME_NP
+    u = xt[xt[S[:, :, 0] ^ S[:, :, 2]]]
+    v = xt[xt[S[:, :, 1] ^ S[:, :, 3]]]
+    S[:, :, 0] ^= u
+    S[:, :, 1] ^= v
+    S[:, :, 2] ^= u
+    S[:, :, 3] ^= v
+    return _mix_columns_np(S)
+
+
+def _encode_blocks_np(round_keys, blocks):
+    """
+    :param round_keys: (Nr + 1, 16) uint8 array of round keys
+    :param blocks: (N, 16) uint8 array of plaintext blocks
+    :return: (N, 16) uint8 array of ciphertext blocks
+    """
+    S = blocks ^ round_keys[0]
+    for i in range(1, Nr):
+        S = _S_BOX_NP[S][:, _SHIFT_ROWS_NP]
+        S = _mix_columns_np(S.reshape(-1, Nb, 4)).reshape(-1, LENGTH)
+        S ^= round_keys[i]
+    S = _S_BOX_NP[S][:, _SHIFT_ROWS_NP]
+    S ^= round_keys[Nr]
+    return S
+
+
+def _decode_blocks_np(round_keys, blocks):
+    """
+    :param round_keys: (Nr + 1, 16) uint8 array of round keys
+    :param blocks: (N, 16) uint8 array of ciphertext blocks
+    :return: (N, 16) uint8 array of plaintext blocks
+    """
+    S = blocks ^ round_keys[Nr]
+    for i in range(Nr - 1, 0, -1):
+        S = _INV_S_BOX_NP[S[:, _INV_SHIFT_ROWS_NP]]
+        S ^= round_keys[i]
+        S = _inv_mix_columns_np(S.reshape(-1, Nb, 4)).reshape(-1, LENGTH)
+    S = _INV_S_BOX_NP[S[:, _INV_SHIFT_ROWS_NP]]
+    S ^= round_keys[0]
+    return S
+
+
+def _check_counter(nonce, start, n):
+    # the counter must not wrap around: the keystream would repeat (the same as C.to_bytes(c_size) raises)
+    c_size = LENGTH - len(nonce)
+    if start + n > 1 << (8 * c_size):
+        raise OverflowError("counter does not fit in %d bytes" % c_size)
+    return c_size
+
+
+def _counter_blocks_np(nonce, start, n):
+    """
+    :return: (n, 16) uint8 array of counter blocks  nonce || start, ..., nonce || start + n - 1
+    """
+    c_size = _check_counter(nonce, start, n)
+    if start + n > 1 << 64:     # counters beyond uint64 (possible only with short nonces)
+        blocks = b''.join(nonce + C.to_bytes(c_size, 'big') for C in range(start, start + n))
+        return np.frombuffer(blocks, dtype=np.uint8).reshape(n, LENGTH).copy()
+    counters = np.arange(start, start + n, dtype=np.uint64).astype('>u8').view(np.uint8).reshape(n, 8)
+    blocks = np.zeros((n, LENGTH), dtype=np.uint8)
+    blocks[:, :len(nonce)] = np.frombuffer(nonce, dtype=np.uint8)
+    if c_size >= 8:
+        blocks[:, LENGTH - 8:] = counters
+    else:
+        blocks[:, len(nonce):] = counters[:, 8 - c_size:]
+    return blocks
+
+
 class AES:
     """
     AES (Advanced Encryption Standard) - a symmetric block cipher standardized by NIST.
@@ -149,15 +315,42 @@ class AES:
      - Cipher-Block Chaining (CBC)
      - Counter Mode (CTR)
 
+    Block engines:
+     - 'ttable' - each round is 16 table lookups and XORs on 32-bit column words (default)
+     - 'state'  - straightforward 4x4 state with SubBytes, ShiftRows, MixColumns, AddRoundKey
+    If NumPy is available, ECB and CTR messages of at least VECTOR_THRESHOLD bytes
+    are processed with all blocks at once, regardless of the engine.
+
     """
     MODES = ['ecb', 'cbc', 'ctr']
+    ENGINES = ['ttable', 'state']
 
-    def __init__(self, key, mode='ecb', iv=None, nonce=None):
-        self.keys = _key_expansion(key)
+    def __init__(self, key, mode='ecb', iv=None, nonce=None, engine='ttable', keystream_cache=None):
+        self._setup(_get_schedule(key), mode, iv, nonce, engine)
+        self.keystream_cache = keystream_cache
+
+    @classmethod
+    def _from_keys(cls, keys, mode='ecb', iv=None, nonce=None, engine='ttable'):
+        """
+        create cipher from already expanded key (output of _key_expansion)
+        """
+        cipher = cls.__new__(cls)
+        cipher._setup(_schedule(keys), mode, iv, nonce, engine)
+        return cipher
+
+    def _setup(self, schedule, mode, iv, nonce, engine):
+        self.keys, self._ek, self._dk = schedule
+        self._round_keys = None     # (Nr + 1, 16) uint8 array for the NumPy path, built on first use
+        self.keystream_cache = None
         assert mode in self.MODES
+        assert engine in self.ENGINES
         self._mode = mode
         self._iv = iv
         self.nonce = nonce
+        self._engine = engine
+        if engine == 'ttable':
+            self._encode_block = self._encode_block_ttable
+            self._decode_block = self._decode_block_ttable
 
     @staticmethod
     def pad(text):
@@ -188,20 +381,46 @@ class AES:
         return text[:i]
 
     def encode(self, message):
+        return bytes(self.encode_into(message, bytearray(len(message))))
+
+    def decode(self, message):
+        return bytes(self.decode_into(message, bytearray(len(message))))
+
+    def encode_into(self, src, dst):
+        """
+        encode src and write the result directly to dst (dst may be the same buffer as src)
+
+        :param src: message (any bytes-like object)
+        :param dst: writable bytes-like object of size at least len(src)
+        :return: dst
+        """
+        src, out = memoryview(src).cast('B'), memoryview(dst).cast('B')
+        assert len(out) >= len(src)
         if self._mode == 'ecb':
-            return self._encode_ecb(message)
+            self._encode_ecb(src, out)
         elif self._mode == 'cbc':
-            return self._encode_cbc(message)
+            self._encode_cbc(src, out)
         elif self._mode == 'ctr':
-            return self._encode_ctr(message)
+            self._encode_ctr(src, out)
+        return dst
 
-    def decode(self, message):
+    def decode_into(self, src, dst):
+        """
+        decode src and write the result directly to dst (dst may be the same buffer as src)
+
+        :param src: message (any bytes-like object)
+        :param dst: writable bytes-like object of size at least len(src)
+        :return: dst
+        """
+        src, out = memoryview(src).cast('B'), memoryview(dst).cast('B')
+        assert len(out) >= len(src)
         if self._mode == 'ecb':
-            return self._decode_ecb(message)
+            self._decode_ecb(src, out)
         elif self._mode == 'cbc':
-            return self._decode_cbc(message)
+            self._decode_cbc(src, out)
         elif self._mode == 'ctr':
-            return self._decode_ctr(message)
+            self._decode_ctr(src, out)
+        return dst
 
     def _encode_block(self, block):
         S = [[block[4 * i + j] for i in range(Nb)] for j in range(4)]
@@ -239,32 +458,104 @@ class AES:
                 s.append(S[j][i])
         return s
 
-    def _encode_ecb(self, p):
+    def _encode_block_ttable(self, block):
+        ek = self._ek
+        te0, te1, te2, te3 = _TE0, _TE1, _TE2, _TE3
+        s0, s1, s2, s3 = unpack('>4I', block)
+        s0 ^= ek[0]
+        s1 ^= ek[1]
+        s2 ^= ek[2]
+        s3 ^= ek[3]
+        for i in range(Nb, Nr * Nb, Nb):
+            t0 = te0[s0 >> 24] ^ te1[(s1 >> 16) & 0xff] ^ te2[(s2 >> 8) & 0xff] ^ te3[s3 & 0xff] ^ ek[i]
+            t1 = te0[s1 >> 24] ^ te1[(s2 >> 16) & 0xff] ^ te2[(s3 >> 8) & 0xff] ^ te3[s0 & 0xff] ^ ek[i + 1]
+            t2 = te0[s2 >> 24] ^ te1[(s3 >> 16) & 0xff] ^ te2[(s0 >> 8) & 0xff] ^ te3[s1 & 0xff] ^ ek[i + 2]
+            t3 = te0[s3 >> 24] ^ te1[(s0 >> 16) & 0xff] ^ te2[(s1 >> 8) & 0xff] ^ te3[s2 & 0xff] ^ ek[i + 3]
+            s0, s1, s2, s3 = t0, t1, t2, t3
+        # last round has no MixColumns
+        sb = _S_BOX
+        return pack('>4I',
+                    (sb[s0 >> 24] << 24 | sb[(s1 >> 16) & 0xff] << 16 | sb[(s2 >> 8) & 0xff] << 8 | sb[s3 & 0xff])
+                    ^ ek[40],
+                    (sb[s1 >> 24] << 24 | sb[(s2 >> 16) & 0xff] << 16 | sb[(s3 >> 8) & 0xff] << 8 | sb[s0 & 0xff])
+                    ^ ek[41],
+                    (sb[s2 >> 24] << 24 | sb[(s3 >> 16) & 0xff] << 16 | sb[(s0 >> 8) & 0xff] << 8 | sb[s1 & 0xff])
+                    ^ ek[42],
+                    (sb[s3 >> 24] << 24 | sb[(s0 >> 16) & 0xff] << 16 | sb[(s1 >> 8) & 0xff] << 8 | sb[s2 & 0xff])
+                    ^ ek[43])
+
+    def _decode_block_ttable(self, block):
+        dk = self._dk
+        td0, td1, td2, td3 = _TD0, _TD1, _TD2, _TD3
+        s0, s1, s2, s3 = unpack('>4I', block)
+        s0 ^= dk[0]
+        s1 ^= dk[1]
+        s2 ^= dk[2]
+        s3 ^= dk[3]
+        for i in range(Nb, Nr * Nb, Nb):
+            t0 = td0[s0 >> 24] ^ td1[(s3 >> 16) & 0xff] ^ td2[(s2 >> 8) & 0xff] ^ td3[s1 & 0xff] ^ dk[i]
+            t1 = td0[s1 >> 24] ^ td1[(s0 >> 16) & 0xff] ^ td2[(s3 >> 8) & 0xff] ^ td3[s2 & 0xff] ^ dk[i + 1]
+            t2 = td0[s2 >> 24] ^ td1[(s1 >> 16) & 0xff] ^ td2[(s0 >> 8) & 0xff] ^ td3[s3 & 0xff] ^ dk[i + 2]
+            t3 = td0[s3 >> 24] ^ td1[(s2 >> 16) & 0xff] ^ td2[(s1 >> 8) & 0xff] ^ td3[s0 & 0xff] ^ dk[i + 3]
+            s0, s1, s2, s3 = t0, t1, t2, t3
+        # last round has no InvMixColumns
+        isb = _INV_S_BOX
+        return pack('>4I',
+                    (isb[s0 >> 24] << 24 | isb[(s3 >> 16) & 0xff] << 16 | isb[(s2 >> 8) & 0xff] << 8 | isb[s1 & 0xff])
+                    ^ dk[40],
+                    (isb[s1 >> 24] << 24 | isb[(s0 >> 16) & 0xff] << 16 | isb[(s3 >> 8) & 0xff] << 8 | isb[s2 & 0xff])
+                    ^ dk[41],
+                    (isb[s2 >> 24] << 24 | isb[(s1 >> 16) & 0xff] << 16 | isb[(s0 >> 8) & 0xff] << 8 | isb[s3 & 0xff])
+                    ^ dk[42],
+                    (isb[s3 >> 24] << 24 | isb[(s2 >> 16) & 0xff] << 16 | isb[(s1 >> 8) & 0xff] << 8 | isb[s0 & 0xff])
+                    ^ dk[43])
+
+    def _encode_ecb(self, p, out):
         """
         Electronic CodeBook.
         Each block of plaintext is encrypted independently of any other block.
 
         :param p: plaintext
-        :return: ciphertext
+        :param out: memoryview the ciphertext is written to
         """
-        res = b''
+        if len(p) >= VECTOR_THRESHOLD and _load_numpy():
+            return self._ecb_np(p, out, _encode_blocks_np)
         for i in range(0, len(p), LENGTH):
-            res += self._encode_block(p[i:i + LENGTH])
-        return res
+            out[i:i + LENGTH] = self._encode_block(p[i:i + LENGTH])
 
-    def _decode_ecb(self, c):
+    def _decode_ecb(self, c, out):
         """
         Each block of ciphertext is decrypted independently of any other block.
 
         :param c: ciphertext
-        :return: plaintext
+        :param out: memoryview the plaintext is written to
         """
-        res = b''
+        if len(c) >= VECTOR_THRESHOLD and _load_numpy():
+            return self._ecb_np(c, out, _decode_blocks_np)
         for i in range(0, len(c), LENGTH):
-            res += self._decode_block(c[i:i + LENGTH])
-        return res
+            out[i:i + LENGTH] = self._decode_block(c[i:i + LENGTH])
 
-    def _encode_cbc(self, p):
+    def _np_round_keys(self):
+        if self._round_keys is None:
+            self._round_keys = np.array(self.keys, dtype=np.uint8).reshape(Nr + 1, LENGTH)
+        return self._round_keys
+
+    def _ecb_np(self, text, out, cipher):
+        """
+        ECB over all blocks at once (in chunks of VECTOR_CHUNK bytes)
+
+        :param text: message, its length should be a multiple of LENGTH
+        :param out: memoryview the result is written to
+        :param cipher: _encode_blocks_np or _decode_blocks_np
+        """
+        data = np.frombuffer(text, dtype=np.uint8).reshape(-1, LENGTH)
+        res = np.frombuffer(out, dtype=np.uint8)[:len(text)].reshape(-1, LENGTH)
+        step = VECTOR_CHUNK // LENGTH
+        round_keys = self._np_round_keys()
+        for i in range(0, len(data), step):
+            res[i:i + step] = cipher(round_keys, data[i:i + step])
+
+    def _encode_cbc(self, p, out, C=None):
         """
         Ciphertext Block Chaining.
         It is a mode of operation where each plaintext block
@@ -273,37 +564,39 @@ class AES:
         if initial vector is None - generate random 16-byte vector
 
         :param p: plaintext
-        :return: ciphertext
+        :param out: memoryview the ciphertext is written to
+        :param C: previous ciphertext block (initial vector if None)
+        :return: last ciphertext block
         """
-        res = b''
-        if self._iv is None:
-            self._iv = urandom(16)
-        C = self._iv
+        if C is None:
+            if self._iv is None:
+                self._iv = urandom(16)
+            C = self._iv
         for i in range(0, len(p), LENGTH):
-            block = p[i:i + LENGTH]
-            C = self._encode_block(_xor_words(block, C))
-            res += C
-        return res
+            C = self._encode_block(_xor_bytes(p[i:i + LENGTH], C))
+            out[i:i + LENGTH] = C
+        return C
 
-    def _decode_cbc(self, c):
+    def _decode_cbc(self, c, out, C=None):
         """
         Decryption regarding encryption scheme:
          - decode block
          - XOR result with previous decrypted block
 
         :param c: ciphertext
-        :return: plaintext
+        :param out: memoryview the plaintext is written to
+        :param C: previous ciphertext block (initial vector if None)
+        :return: last ciphertext block
         """
-        result = b''
-        C = self._iv
+        if C is None:
+            C = self._iv
         for i in range(0, len(c), LENGTH):
-            block = c[i:i + LENGTH]
-            r = self._decode_block(block)
-            result += bytearray(_xor_words(r, C))
+            block = bytes(c[i:i + LENGTH])  # copy: out may be the same buffer as c
+            out[i:i + LENGTH] = _xor_bytes(self._decode_block(block), C)
             C = block
-        return result
+        return C
 
-    def _encode_ctr(self, p):
+    def _encode_ctr(self, p, out, counter=0):
         """
         CounTeR mode.
         This mode turns the block cipher into a stream cipher.
@@ -313,31 +606,484 @@ class AES:
         counter block consists of:
          - fixed nonce, set at initialization
            If not - generate random value of size LENGTH / 2 = 8
-         - counter (in this implementation always starts with 0)
+         - counter (starts with 0, unless the message continues a previous one)
          CounterBlock = Nonce || Counter
          total size - LENGTH
 
         :param p: plaintext
-        :return: ciphertext
+        :param out: memoryview the ciphertext is written to
+        :param counter: counter value of the first block
         """
-        C = 0
-        res = b''
+        C = counter
         if self.nonce is None:
             self.nonce = urandom(8)
         assert len(self.nonce) < LENGTH
+        if self.keystream_cache is not None:
+            ks = self.keystream_cache.get(self, counter, (len(p) + LENGTH - 1) // LENGTH)
+            out[:len(p)] = _xor_bytes(p, ks)
+            return
+        if len(p) >= VECTOR_THRESHOLD and _load_numpy():
+            return self._ctr_np(p, out, counter)
         c_size = 16 - len(self.nonce)
         for i in range(0, len(p), LENGTH):
+            block = p[i:i + LENGTH]
             ks = self._encode_block(self.nonce + C.to_bytes(c_size, 'big'))
-            res += bytearray(_xor_words(ks, p[i:i + LENGTH]))
+            out[i:i + len(block)] = _xor_bytes(block, ks)
             C += 1
-        return res
 
-    def _decode_ctr(self, c):
+    def _ctr_np(self, p, out, counter):
+        """
+        CTR with all counter blocks of a chunk built and encrypted at once
+
+        :param p: plaintext
+        :param out: memoryview the ciphertext is written to
+        :param counter: counter value of the first block
+        """
+        _check_counter(self.nonce, counter, (len(p) + LENGTH - 1) // LENGTH)
+        data = np.frombuffer(p, dtype=np.uint8)
+        res = np.frombuffer(out, dtype=np.uint8)
+        round_keys = self._np_round_keys()
+        for i in range(0, len(data), VECTOR_CHUNK):
+            chunk = data[i:i + VECTOR_CHUNK]
+            n = (len(chunk) + LENGTH - 1) // LENGTH
+            ks = _encode_blocks_np(round_keys, _counter_blocks_np(self.nonce, counter + i // LENGTH, n))
+            np.bitwise_xor(chunk, ks.reshape(-1)[:len(chunk)], out=res[i:i + len(chunk)])
+
+    def _keystream(self, counter, n):
+        """
+        :return: n keystream blocks (CTR) starting with the counter block nonce || counter
+        """
+        if n * LENGTH >= VECTOR_THRESHOLD and _load_numpy():
+            return _encode_blocks_np(self._np_round_keys(), _counter_blocks_np(self.nonce, counter, n)).tobytes()
+        c_size = LENGTH - len(self.nonce)
+        return b''.join(self._encode_block(self.nonce + C.to_bytes(c_size, 'big')) for C in range(counter, counter + n))
+
+    def _decode_ctr(self, c, out, counter=0):
         """
         Basically the same as encryption except with ciphertext
 
         :param c: ciphertext
-        :return: plaintext
+        :param out: memoryview the plaintext is written to
+        :param counter: counter value of the first block
+        """
+        self._encode_ctr(c, out, counter)
+
+    def ctr_at(self, offset, data):
+        """
+        Random access to a CTR-encoded message: encode / decode a piece of it, that starts at byte *offset*.
+        Only the counter blocks covering the piece are encrypted:
+        block offset // LENGTH is the first one, its first offset % LENGTH keystream bytes are skipped.
+
+        :param offset: position of data in the whole message
+        :param data: piece of the message
+        :return: processed piece, the same as encode(message)[offset:offset + len(data)]
+        """
+        assert self._mode == 'ctr' and self.nonce is not None
+        lead = offset % LENGTH
+        src = bytes(lead) + bytes(data)
+        out = bytearray(len(src))
+        self._encode_ctr(memoryview(src), memoryview(out), offset // LENGTH)
+        return bytes(out[lead:])
+
+    def encode_parallel(self, message, workers=None, segment=PARALLEL_SEGMENT):
+        """
+        encode message in a pool of processes, each task handles *segment* bytes.
+        Blocks are independent in ECB and in CTR (keystream block depends only on nonce and counter),
+        CBC encryption is sequential by nature, so it is done in the current process.
+
+        :param message: message to be encoded
+        :param workers: number of processes (os.cpu_count() if None)
+        :param segment: size of one task in bytes, multiple of LENGTH
+        :return: encoded message, the same as encode(message)
+        """
+        if self._mode == 'cbc':
+            return self.encode(message)
+        return self._run_parallel(message, True, workers, segment)
+
+    def decode_parallel(self, message, workers=None, segment=PARALLEL_SEGMENT):
+        """
+        decode message in a pool of processes, each task handles *segment* bytes.
+        In CBC each plaintext block depends only on two ciphertext blocks,
+        so it's enough to pass the last ciphertext block before the segment to the task.
+
+        :param message: message to be decoded
+        :param workers: number of processes (os.cpu_count() if None)
+        :param segment: size of one task in bytes, multiple of LENGTH
+        :return: decoded message, the same as decode(message)
+        """
+        return self._run_parallel(message, False, workers, segment)
+
+    def _run_parallel(self, message, encrypt, workers, segment):
+        from concurrent.futures import ProcessPoolExecutor     # not needed by most users of the module
+        assert segment % LENGTH == 0
+        if len(message) <= segment:
+            return self.encode(message) if encrypt else self.decode(message)
+        if self._mode == 'ctr' and self.nonce is None:
+            self.nonce = urandom(8)
+        src = memoryview(message).cast('B')
+        out = bytearray(len(src))
+        # expanded key is sent to every process once, not with every task
+        with ProcessPoolExecutor(workers, initializer=_init_worker,
+                                 initargs=(self.keys, self._mode, self._iv, self.nonce, self._engine)) as pool:
+            tasks = []
+            for start in range(0, len(src), segment):
+                chain = bytes(src[start - LENGTH:start]) if start else self._iv
+                tasks.append((start, pool.submit(_parallel_task, encrypt, bytes(src[start:start + segment]),
+                                                 start, chain)))
+            # results are written straight to their place in the output buffer
+            for start, task in tasks:
+                res = task.result()
+                out[start:start + len(res)] = res
+        return bytes(out)
+
+    def encryptor(self, padding=False):
+        """
+        :param padding: pad the message (see AES.pad) when finalizing (ignored in CTR mode)
+        :return: AESStream object for incremental encryption
+        """
+        if self._mode == 'cbc' and self._iv is None:
+            self._iv = urandom(16)
+        if self._mode == 'ctr' and self.nonce is None:
+            self.nonce = urandom(8)
+        return AESStream(self, True, padding)
+
+    def decryptor(self, padding=False):
+        """
+        :param padding: unpad the message (see AES.unpad) when finalizing (ignored in CTR mode)
+        :return: AESStream object for incremental decryption
+        """
+        return AESStream(self, False, padding)
+
+
+class AESStream:
+    """
+    Incremental encryption / decryption of a message that comes in chunks of any size.
+
+    update(chunk) returns the processed part of all data passed so far,
+    finalize() returns the rest. Between calls it keeps:
+     - not yet processed bytes (less than a block;
+       when decrypting with padding the last full block is held back too, since it has to be unpadded)
+     - the previous ciphertext block (CBC)
+     - the counter of the next block (CTR)
+    """
+
+    def __init__(self, cipher, encrypt, padding):
+        self._cipher = cipher
+        self._encrypt = encrypt
+        self._padding = padding and cipher._mode != 'ctr'
+        self._buffer = b''
+        self._chain = cipher._iv
+        self._counter = 0
+        self._finalized = False
+
+    def _process(self, data):
+        out = bytearray(len(data))
+        src, dst = memoryview(data), memoryview(out)
+        cipher, mode = self._cipher, self._cipher._mode
+        if mode == 'ecb':
+            if self._encrypt:
+                cipher._encode_ecb(src, dst)
+            else:
+                cipher._decode_ecb(src, dst)
+        elif mode == 'cbc':
+            if self._encrypt:
+                self._chain = cipher._encode_cbc(src, dst, self._chain)
+            else:
+                self._chain = cipher._decode_cbc(src, dst, self._chain)
+        elif mode == 'ctr':
+            cipher._encode_ctr(src, dst, self._counter)
+            self._counter += len(data) // LENGTH
+        return bytes(out)
+
+    def update(self, data):
+        """
+        :param data: next chunk of the message
+        :return: processed bytes (all whole blocks available so far)
+        """
+        if self._finalized:
+            raise ValueError("Context was already finalized")
+        data = self._buffer + bytes(data)
+        n = len(data) - len(data) % LENGTH
+        if self._padding and not self._encrypt and n == len(data):
+            n = max(n - LENGTH, 0)
+        self._buffer = data[n:]
+        return self._process(data[:n])
+
+    def finalize(self):
+        """
+        :return: the rest of the processed message
+        """
+        if self._finalized:
+            raise ValueError("Context was already finalized")
+        self._finalized = True
+        data, self._buffer = self._buffer, b''
+        if self._padding and self._encrypt:
+            data = AES.pad(data)
+        elif self._cipher._mode != 'ctr' and len(data) % LENGTH:
+            raise ValueError("Message length should be a multiple of the block size")
+        res = self._process(data)
+        if self._padding and not self._encrypt:
+            res = AES.unpad(res)
+        return res
+
+
+class KeystreamCache:
+    """
+    Bounded LRU cache of CTR keystream for (key, nonce, first counter).
+    Useful when the same key and nonce encode many messages of bounded length:
+    after the first message, encoding is just XOR with cached keystream.
+
+    A longer keystream serves all shorter requests with the same first counter.
+    Least recently used entries are dropped when total size exceeds max_bytes.
+    Can be shared by several AES objects (pass it as keystream_cache) and used from several threads.
+    """
+
+    def __init__(self, max_bytes=KEYSTREAM_CACHE_SIZE):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _entry_key(cipher, counter):
+        # cipher key (the first Nk words of expanded key) identifies the whole key schedule
+        return bytes(b for w in cipher.keys[:Nk] for b in w), bytes(cipher.nonce), counter
+
+    def get(self, cipher, counter, n):
         """
-        return self._encode_ctr(c)
+        :param cipher: AES object in CTR mode
+        :param counter: counter of the first block
+        :param n: number of blocks
+        :return: keystream of at least n blocks
+        """
+        key = self._entry_key(cipher, counter)
+        with self._lock:
+            ks = self._entries.get(key)
+            if ks is not None and len(ks) >= n * LENGTH:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return ks
+            self.misses += 1
+        ks = cipher._keystream(counter, n)
+        self._put(key, ks)
+        return ks
+
+    def _put(self, key, ks):
+        if len(ks) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+                if len(old) > len(ks):     # another thread has already stored a longer keystream
+                    ks = old
+            self._entries[key] = ks
+            self.size += len(ks)
+            while self.size > self.max_bytes:
+                _, old = self._entries.popitem(last=False)
+                self.size -= len(old)
+
+    def prefill(self, cipher, counter, n):
+        """
+        compute keystream in a background thread, so that later calls only XOR
+
+        :return: started thread (join it to wait for the keystream)
+        """
+        thread = threading.Thread(target=lambda: self._put(self._entry_key(cipher, counter),
+                                                           cipher._keystream(counter, n)), daemon=True)
+        thread.start()
+        return thread
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+class CTRReader(io.RawIOBase):
+    """
+    Read-only file-like object over a CTR-encoded file that returns decoded bytes.
+    Supports seek(), so any part of the file can be read without decoding everything before it.
+    """
+
+    def __init__(self, cipher, raw):
+        """
+        :param cipher: AES object in CTR mode with the nonce used for encryption
+        :param raw: seekable file-like object with the ciphertext
+        """
+        assert cipher._mode == 'ctr' and cipher.nonce is not None
+        self._cipher = cipher
+        self._raw = raw
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self._raw.seek(offset, whence)
+
+    def tell(self):
+        return self._raw.tell()
+
+    def readinto(self, b):
+        pos = self._raw.tell()
+        data = self._raw.read(len(b))
+        if not data:
+            return 0
+        b[:len(data)] = self._cipher.ctr_at(pos, data)
+        return len(data)
+
+
+# ============= PARALLEL WORKERS =============
+_worker_cipher = None
+
+
+def _init_worker(keys, mode, iv, nonce, engine):
+    global _worker_cipher
+    _worker_cipher = AES._from_keys(keys, mode, iv, nonce, engine)
+
+
+def _parallel_task(encrypt, data, start, chain):
+    """
+    :param encrypt: True for encryption, False for decryption
+    :param data: segment of the message
+    :param start: offset of the segment in the message
+    :param chain: ciphertext block before the segment (CBC)
+    :return: processed segment
+    """
+    cipher = _worker_cipher
+    out = bytearray(len(data))
+    src, dst = memoryview(data), memoryview(out)
+    if cipher._mode == 'ecb':
+        if encrypt:
+            cipher._encode_ecb(src, dst)
+        else:
+            cipher._decode_ecb(src, dst)
+    elif cipher._mode == 'cbc':
+        cipher._decode_cbc(src, dst, chain)
+    elif cipher._mode == 'ctr':
+        cipher._encode_ctr(src, dst, start // LENGTH)
+    return out
+
+
+def process_stream(ctx, src, dst, chunk_size=STREAM_CHUNK):
+    """
+    Pass everything from src through an encryptor / decryptor to dst, reading chunk_size bytes at a time
+
+    :param ctx: AESStream object (AES.encryptor() or AES.decryptor())
+    :param src: file-like object opened for reading in binary mode, or a socket
+    :param dst: file-like object opened for writing in binary mode, or a socket
+    :param chunk_size: number of bytes read at once
+    :return: number of bytes written to dst
+    """
+    read = src.read if hasattr(src, 'read') else src.recv
+    write = dst.write if hasattr(dst, 'write') else dst.sendall
+    total = 0
+    while True:
+        chunk = read(chunk_size)
+        if not chunk:
+            break
+        out = ctx.update(chunk)
+        write(out)
+        total += len(out)
+    out = ctx.finalize()
+    write(out)
+    return total + len(out)
+
+
+def test():
+    import random
+    # FIPS-197, Appendix C.1
+    key = bytes(range(16))
+    block = bytes.fromhex('00112233445566778899aabbccddeeff')
+    expected = bytes.fromhex('69c4e0d86a7b0430d8cdb78070b4c55a')
+    for engine in AES.ENGINES:
+        cipher = AES(key, engine=engine)
+        print(cipher.encode(block) == expected and cipher.decode(expected) == block)
+
+    # NumPy path (VECTOR_THRESHOLD bytes and more) against the scalar one (shorter pieces)
+    key, iv = urandom(16), urandom(16)
+    message = urandom(4 * VECTOR_THRESHOLD + 3 * LENGTH)
+    ecb = AES(key)
+    print(ecb.encode(message) == b''.join(ecb.encode(message[i:i + LENGTH]) for i in range(0, len(message), LENGTH)))
+    cbc = AES(key, 'cbc', iv=iv)
+    ctx = cbc.decryptor()
+    ciphertext = cbc.encode(message)
+    print(cbc.decode(ciphertext) == message ==
+          b''.join(ctx.update(ciphertext[i:i + LENGTH]) for i in range(0, len(ciphertext), LENGTH)))
+    for nonce in (urandom(8), urandom(9), urandom(12)):
+        cipher = AES(key, 'ctr', nonce=nonce)
+        pieces = b''.join(cipher.ctr_at(i, message[i:i + 48]) for i in range(0, len(message), 48))
+        print(cipher.encode(message) == pieces)
+
+    # encode_into / decode_into in place
+    for mode in AES.MODES:
+        cipher = AES(key, mode, iv=iv, nonce=urandom(8))
+        buf = bytearray(message)
+        cipher.encode_into(buf, buf)
+        ok = buf == cipher.encode(message)
+        cipher.decode_into(buf, buf)
+        print(ok and buf == message)
+
+    # streaming with random chunks
+    for mode in AES.MODES:
+        for padding in (False, True):
+            cipher = AES(key, mode, iv=iv, nonce=urandom(8))
+            text = message[:random.randrange(len(message))] if padding or mode == 'ctr' else message
+            for encrypt in (True, False):
+                ctx = cipher.encryptor(padding) if encrypt else cipher.decryptor(padding)
+                out, i = [], 0
+                while i < len(text):
+                    n = random.randrange(1, 100)
+                    out.append(ctx.update(text[i:i + n]))
+                    i += n
+                out.append(ctx.finalize())
+                res = b''.join(out)
+                if encrypt:
+                    ok = res == cipher.encode(AES.pad(text) if padding and mode != 'ctr' else text)
+                    text = res
+                else:
+                    print(ok and len(res) <= len(message) and res == message[:len(res)])
+
+    # process pool
+    for mode in AES.MODES:
+        cipher = AES(key, mode, iv=iv, nonce=urandom(8))
+        ciphertext = cipher.encode(message)
+        print(cipher.encode_parallel(message, workers=2, segment=16 * LENGTH) == ciphertext and
+              cipher.decode_parallel(ciphertext, workers=2, segment=16 * LENGTH) == message)
+
+    # random access at unaligned offsets
+    cipher = AES(key, 'ctr', nonce=urandom(8))
+    ciphertext = cipher.encode(message)
+    reader = CTRReader(cipher, io.BytesIO(ciphertext))
+    ok = True
+    for _ in range(20):
+        offset, n = random.randrange(len(message)), random.randrange(1, 2 * VECTOR_THRESHOLD)
+        ok &= cipher.ctr_at(offset, ciphertext[offset:offset + n]) == message[offset:offset + n]
+        reader.seek(offset)
+        ok &= reader.read(n) == message[offset:offset + n]
+    print(ok)
+
+    # caches
+    cache = KeystreamCache()
+    nonce = bytearray(urandom(8))
+    cached = AES(key, 'ctr', nonce=nonce, keystream_cache=cache)
+    first = cached.encode(message[:100])     # miss
+    second = cached.encode(message[:50])     # hit: shorter keystream with the same first counter
+    print(first == AES(key, 'ctr', nonce=bytes(nonce)).encode(message[:100]) and second == first[:50] and
+          (cache.hits, cache.misses) == (1, 1))
+    cached.encode(message[:200])             # miss: longer keystream
+    print((cache.hits, cache.misses) == (1, 2))
+
+    schedule = AES(key).keys
+    print(AES(key).keys is schedule)
+    clear_key_cache(key)
+    print(AES(key).keys is not schedule and AES(key).keys == schedule)
+
 
+if __name__ == "__main__":
+    test()
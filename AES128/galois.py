@@ -7,10 +7,62 @@ def xtime(a):
     return (((a << 1) ^ 0x1b) & 0xff) if (a & 0x80) else (a << 1)
 
 
+def _get_exp_log_tables():
+    """ Exponent and logarithm tables to the base of generator 0x03 of the multiplicative group GF(2 ** 8)*
+
+    a * b = 3 ** (log(a) + log(b)),  a, b != 0
+    exp table is doubled (510 entries), so that log(a) + log(b) never has to be reduced modulo 255
+    """
+    exp, log = [0] * 510, [0] * 256
+    x = 1
+    for i in range(255):
+        exp[i] = exp[i + 255] = x
+        log[x] = i
+        x ^= xtime(x)  # x * 3 = x * 2 + x
+    return tuple(exp), tuple(log)
+
+
+_EXP, _LOG = _get_exp_log_tables()
+# a ** (-1) = 3 ** (255 - log(a)),  0 is mapped to 0 (as in S-box)
+_INV = (0,) + tuple(_EXP[255 - _LOG[a]] for a in range(1, 256))
+_INV_BYTES = bytes(_INV)   # translation table for inv_bytes
+
+
+def mul(a, b):
+    """ Multiplication of bytes a and b in GF(2 ** 8) """
+    if a == 0 or b == 0:
+        return 0
+    return _EXP[_LOG[a] + _LOG[b]]
+
+
+def inv(a):
+    """ Inverse of byte a in GF(2 ** 8) (0 for a = 0) """
+    return _INV[a]
+
+
+def mul_bytes(data, c):
+    """ Multiplication of every byte of data by constant c in GF(2 ** 8)
+
+    :param data: bytes-like object
+    :param c: constant (byte or GF8)
+    :return: bytes object: [d * c for d in data]
+    """
+    if isinstance(c, GF8):
+        c = c.value
+    return bytes(data).translate(bytes(mul(x, c) for x in range(2 ** 8)))
+
+
+def inv_bytes(data):
+    """ Inverse of every byte of data in GF(2 ** 8) """
+    return bytes(data).translate(_INV_BYTES)
+
+
 class GF8:
     """
      Class representing a finite field GF(2 ** 8)
     """
+    __slots__ = ('value',)
+
     def __init__(self, val: int):
         self.value = val & 0xff      # elements in field should be in range(0, 256)
 
@@ -32,36 +84,44 @@ class GF8:
         """
         if isinstance(other, int):
             other = GF8(other)
-        res = 0
-        for i in range(8):
-            if 1 << i & other.value:
-                buf = self.value
-                for _ in range(i):
-                    buf = xtime(buf)
-                res ^= buf
-        return GF8(res)
+        return GF8(mul(self.value, other.value))
 
     def inv(self):
         """ Finds inverse of the element in GF(2 ** 8)
 
-        Based on the Euler's theorem
-        Since the nonzero elements of GF(p**n) form a finite group with respect to multiplication,
-        a ** (p ** n − 1) = 1 (for a ≠ 0), thus the inverse of a is a ** (p ** n − 2)
+        With exp/log tables to the base 3:  a ** (-1) = 3 ** (255 - log(a)).
+        The inverses of all bytes are precomputed in _INV, so this is a table lookup
+        (0 has no inverse and is mapped to 0, as in S-box)
 
         :return: self ** (-1)
         """
-        if self.value == 0:
-            return self
-        res = GF8(1)
-        power = self
-        for i in range(8):
-            if 1 << i & 254:
-                res *= power
-            power *= power
-        return res
+        return GF8(_INV[self.value])
 
     def __repr__(self):
         return hex(self.value)
 
     def __str__(self):
         return hex(self.value)
+
+
+def test():
+    def mul_xtime(a, b):
+        # shift-and-add multiplication: a * b = sum of a * x ** i over the bits i of b
+        res = 0
+        while b:
+            if b & 1:
+                res ^= a
+            a, b = xtime(a), b >> 1
+        return res
+
+    print(all(mul(a, b) == mul_xtime(a, b) for a in range(256) for b in range(256)))
+    print(inv(0) == 0 and all(mul(a, inv(a)) == 1 for a in range(1, 256)))
+    data = bytes(range(256))
+    print(mul_bytes(data, 0x57) == bytes(mul_xtime(x, 0x57) for x in data) == mul_bytes(data, GF8(0x57)))
+    print(inv_bytes(data) == bytes(inv(x) for x in data))
+    print((GF8(0x57) * 0x83).value == 0xc1 and (GF8(0x57) + 0x83).value == 0xd4 and
+          (GF8(0x57) * GF8(0x57).inv()).value == 1)
+
+
+if __name__ == "__main__":
+    test()
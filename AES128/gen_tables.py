@@ -0,0 +1,146 @@
+"""
+    Generator of the lookup tables used by aes.py (S-box, inverse S-box, xtime, T-tables).
+
+    The tables are computed from GF(2 ** 8) arithmetic once and written to tables.py,
+    so that importing aes doesn't have to build them every time.
+
+    python gen_tables.py           - check that tables.py matches the generators, benchmark import of aes
+    python gen_tables.py generate  - (re)write tables.py
+"""
+# from Cryptography.AES128.galois import GF8, xtime
+from galois import GF8, xtime
+import os
+import subprocess
+import sys
+import timeit
+
+TABLES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tables.py')
+
+
+# cyclic right rotation of x (1 byte) by y bits
+def _rotr(x, y):
+    return ((x >> y) | (x << (8 - y))) & 0xff
+
+
+# cyclic right rotation of w (32-bit word) by y bits
+def _rotr_word(w, y):
+    return ((w >> y) | (w << (32 - y))) & 0xffffffff
+
+
+# ============= S-BOX ==============
+# S-box: substitution values for the byte  (needed for SubBytes)
+def get_s_box():
+    box = []
+    c = GF8(0x63)
+    for i in range(2 ** 8):
+        el = GF8(i).inv().value
+        box.append(c.value ^ el ^ _rotr(el, 4) ^ _rotr(el, 5) ^ _rotr(el, 6) ^ _rotr(el, 7))
+    return tuple(box)
+
+
+# Inverse S-box: substitution values for the byte  (needed for Inverse SubBytes)
+def get_inv_s_box():
+    c = GF8(0x5)
+    inv_box = []
+    for i in range(2 ** 8):
+        el = c + (_rotr(i, 7) ^ _rotr(i, 2) ^ _rotr(i, 5))
+        inv_box.append(el.inv().value)
+    return tuple(inv_box)
+
+
+def get_xtime():
+    return tuple(xtime(i) for i in range(2 ** 8))
+
+
+# ============= T-TABLES ==============
+# T-tables merge SubBytes, ShiftRows and MixColumns of one round into 4 lookups per column
+# (see Sec 4.2 in The Design of Rijndael - implementation on 32-bit processors).
+# Column of the state is kept as a 32-bit big-endian word: s[0,c] || s[1,c] || s[2,c] || s[3,c]
+def get_te_tables(s_box):
+    """
+    Te0[x] = |02 * S[x]|
+             |01 * S[x]|
+             |01 * S[x]|
+             |03 * S[x]|,  Te_i = Te0 rotated right by 8 * i bits
+    """
+    te0 = []
+    for i in range(2 ** 8):
+        s = s_box[i]
+        s2 = xtime(s)
+        te0.append(s2 << 24 | s << 16 | s << 8 | (s2 ^ s))
+    return tuple(tuple(_rotr_word(w, 8 * i) for w in te0) for i in range(4))
+
+
+def get_td_tables(inv_s_box):
+    """
+    Td0[x] = |0e * S^(-1)[x]|
+             |09 * S^(-1)[x]|
+             |0d * S^(-1)[x]|
+             |0b * S^(-1)[x]|,  Td_i = Td0 rotated right by 8 * i bits
+    """
+    td0 = []
+    for i in range(2 ** 8):
+        s = inv_s_box[i]
+        s2 = xtime(s)
+        s4 = xtime(s2)
+        s8 = xtime(s4)
+        td0.append((s8 ^ s4 ^ s2) << 24 | (s8 ^ s) << 16 | (s8 ^ s4 ^ s) << 8 | (s8 ^ s2 ^ s))
+    return tuple(tuple(_rotr_word(w, 8 * i) for w in td0) for i in range(4))
+
+
+def generate_tables():
+    """
+    :return: dict: name of the table in tables.py -> table
+    """
+    s_box, inv_s_box = get_s_box(), get_inv_s_box()
+    tables = {'S_BOX': s_box, 'INV_S_BOX': inv_s_box, 'XTIME': get_xtime()}
+    for i, t in enumerate(get_te_tables(s_box)):
+        tables['TE%d' % i] = t
+    for i, t in enumerate(get_td_tables(inv_s_box)):
+        tables['TD%d' % i] = t
+    return tables
+
+
+def _format_table(name, table, digits):
+    per_line = 16 if digits == 2 else 8
+    lines = []
+    for i in range(0, len(table), per_line):
+        lines.append('    ' + ', '.join('0x%0*x' % (digits, v) for v in table[i:i + per_line]) + ',')
+    return '%s = (\n%s\n)\n' % (name, '\n'.join(lines))
+
+
+def write_tables(path=TABLES_FILE):
+    res = ['# Lookup tables for aes.py.\n# Generated by gen_tables.py - do not edit, run "python gen_tables.py generate" instead.\n']
+    for name, table in generate_tables().items():
+        res.append(_format_table(name, table, 8 if name.startswith('T') else 2))
+    with open(path, 'w') as f:
+        f.write('\n\n'.join(res))
+
+
+def test():
+    import tables
+    for name, table in generate_tables().items():
+        print(name, getattr(tables, name) == table)
+
+
+def benchmark(number=10):
+    """
+    compare time of building the tables at import with import of aes (which loads tables.py)
+    """
+    directory = os.path.dirname(TABLES_FILE)
+    build = timeit.timeit(generate_tables, number=number) / number
+    cmd = [sys.executable, '-c', 'import aes']
+    subprocess.run(cmd, cwd=directory, check=True)  # make sure .pyc files are written
+    load = timeit.timeit(lambda: subprocess.run(cmd, cwd=directory, check=True), number=number) / number
+    base = timeit.timeit(lambda: subprocess.run([sys.executable, '-c', 'pass'], check=True), number=number) / number
+    print('building tables:              %.1f ms' % (build * 1000))
+    print('python start + import aes:    %.1f ms' % (load * 1000))
+    print('python start (for reference): %.1f ms' % (base * 1000))
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ['generate']:
+        write_tables()
+    else:
+        test()
+        benchmark()
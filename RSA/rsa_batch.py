@@ -0,0 +1,202 @@
+"""
+    Fiat's batch RSA: decryption of several ciphertexts at the cost of about one full exponentiation.
+
+    The modulus N = pq is shared by several public keys (N, d_i) with small pairwise coprime exponents d_i.
+    Ciphertexts c_1, ..., c_b encrypted with different exponents are combined into
+        v = c_1 ** (D / d_1) * ... * c_b ** (D / d_b),   D = d_1 * ... * d_b
+    then one exponentiation (with CRT) gives v ** (1 / D) = m_1 * ... * m_b,
+    and the product is split back into m_i along a binary tree, using only exponentiations
+    with small exponents and one inversion per node.
+
+    Small public exponents are only safe with a padding scheme (rsa_oaep.rsaes_oaep_decrypt_batch).
+"""
+import math
+import timeit
+from rsa_studyv import PrivateKey, _crt_exp, euclidian_extended, get_random_prime, encrypt, decrypt
+
+BATCH_EXPONENTS = (3, 5, 7, 11, 13, 17, 19, 23)
+
+
+def _check_exponents(public_exponents):
+    # the split of a batch needs inverses of products of exponents modulo each other
+    for i, d in enumerate(public_exponents):
+        if d < 2:
+            raise ValueError("Public exponents should be greater than 1")
+        for d2 in public_exponents[i + 1:]:
+            if math.gcd(d, d2) != 1:
+                raise ValueError("Public exponents %d and %d are not coprime" % (d, d2))
+
+
+def batch_key_gen(keylength=1024, public_exponents=BATCH_EXPONENTS, prime_gen=get_random_prime):
+    """ Keys for batch decryption: one modulus and a public key for every exponent
+
+    :param keylength: desired size of N = pq
+    :param public_exponents: pairwise coprime public exponents (small primes)
+    :param prime_gen: function that returns a random prime of given bit length
+    :return: list of public keys (N, d_i) and BatchDecryptor
+    """
+    public_exponents = tuple(public_exponents)
+    _check_exponents(public_exponents)
+    D = math.prod(public_exponents)
+    p_length = keylength // 2
+
+    def gen():
+        while True:     # all d_i should be invertible modulo phi(N)
+            p = prime_gen(p_length)
+            if math.gcd(p - 1, D) == 1:
+                return p
+
+    while True:
+        p, q = gen(), gen()
+        if p != q:
+            break
+    return [(p * q, d) for d in public_exponents], BatchDecryptor(p, q, public_exponents)
+
+
+class _Node:
+    __slots__ = ('v', 'E', 'left', 'right', 'index')
+
+    def __init__(self, v, E, left=None, right=None, index=None):
+        self.v, self.E, self.left, self.right, self.index = v, E, left, right, index
+
+
+class BatchDecryptor:
+    """ Private key for public keys (N, d_i) with a common modulus
+
+    decrypt_batch decrypts ciphertexts with distinct exponents at once,
+    decrypt_many splits any ciphertexts into such batches.
+    Root exponents and splitting exponents are cached for every combination of exponents,
+    private keys for single exponents keep their CRT precomputation between calls.
+    """
+
+    def __init__(self, p, q, public_exponents=BATCH_EXPONENTS):
+        self.p, self.q, self.n = p, q, p * q
+        self.phi = (p - 1) * (q - 1)
+        self.public_exponents = tuple(public_exponents)
+        _check_exponents(self.public_exponents)
+        self.keys = {d: self._private_key(d) for d in self.public_exponents}
+        self._roots = {}     # product of exponents of a batch -> PrivateKey for it
+        self._splits = {}
+
+    def _private_key(self, D):
+        """ PrivateKey for public exponent D (so _crt_exp(v, key) = v ** (1 / D)) """
+        _, e = euclidian_extended(D, self.phi)
+        return PrivateKey(self.n, D, e, self.p, self.q)
+
+    def _split(self, E_L, E_R):
+        """ a, b such that X = a * E_L = 1 + b * E_R   (X = 0 mod E_L, X = 1 mod E_R) """
+        res = self._splits.get((E_L, E_R))
+        if res is None:
+            a = euclidian_extended(E_L % E_R, E_R)[1] if E_R > 1 else 0
+            res = self._splits[(E_L, E_R)] = a, (a * E_L - 1) // E_R
+        return res
+
+    def _up(self, items, lo, hi):
+        """ node with v = prod c_i ** (E / d_i),  E = prod d_i  over items[lo:hi] """
+        if hi - lo == 1:
+            d, c = items[lo]
+            return _Node(c, d, index=lo)
+        mid = (lo + hi) // 2
+        L, R = self._up(items, lo, mid), self._up(items, mid, hi)
+        return _Node(pow(L.v, R.E, self.n) * pow(R.v, L.E, self.n) % self.n, L.E * R.E, L, R)
+
+    def _down(self, node, r, out):
+        """ r = prod m_i over the node, split into leaves """
+        if node.left is None:
+            out[node.index] = r
+            return
+        n, L, R = self.n, node.left, node.right
+        a, b = self._split(L.E, R.E)
+        # r ** X = r_L ** X * r_R ** X = v_L ** a * v_R ** b * r_R
+        rX = pow(r, a * L.E, n)
+        t = pow(L.v, a, n) * pow(R.v, b, n) % n
+        inv = pow(rX * t % n, -1, n)        # one inversion for both t ** (-1) and rX ** (-1)
+        r_R = rX * rX % n * inv % n
+        r_L = r * t % n * t % n * inv % n
+        self._down(L, r_L, out)
+        self._down(R, r_R, out)
+
+    def decrypt_batch(self, items, check=True):
+        """
+        :param items: list of (public exponent d, ciphertext c), all d distinct
+        :param check: check that ciphertexts are coprime with N
+        :return: list of decrypted messages (integers)
+        """
+        N = self.n
+        for d, c in items:
+            if d not in self.keys:
+                raise ValueError("Unknown public exponent %d" % d)
+            if c >= N or check and euclidian_extended(c, N)[0] != 1:
+                raise Exception("Message could not be encrypted")
+        if len(items) == 1:
+            d, c = items[0]
+            return [_crt_exp(c, self.keys[d])]
+        if len({d for d, _ in items}) != len(items):
+            raise ValueError("Public exponents in a batch should be distinct")
+        root = self._up(items, 0, len(items))
+        key = self._roots.get(root.E)
+        if key is None:
+            key = self._roots[root.E] = self._private_key(root.E)
+        out = [None] * len(items)
+        self._down(root, _crt_exp(root.v, key), out)
+        return out
+
+    def decrypt_many(self, items, check=True, batch_size=None):
+        """ Decryption of any ciphertexts: they are grouped into batches with distinct exponents
+
+        Ciphertexts left alone in a batch (e.g. all of them, if they use one exponent) are decrypted with CRT,
+        sharing the precomputation for that exponent: CRT parameters, exponent recoding and
+        Montgomery constants (see rsa_studyv.FixedExponentExp) are computed once per BatchDecryptor.
+
+        :param items: iterable of (public exponent d, ciphertext c)
+        :param batch_size: maximum size of a batch (number of exponents if None)
+        :return: list of decrypted messages in the order of items
+        """
+        items = list(items)
+        batch_size = batch_size or len(self.public_exponents)
+        batches = []    # lists of indices of items
+        open_batches = []
+        for i, (d, _) in enumerate(items):
+            for batch in open_batches:
+                if d not in batch[1]:
+                    break
+            else:
+                batch = ([], set())
+                open_batches.append(batch)
+            batch[0].append(i)
+            batch[1].add(d)
+            if len(batch[0]) == batch_size:
+                open_batches.remove(batch)
+                batches.append(batch[0])
+        batches.extend(batch[0] for batch in open_batches)
+        out = [None] * len(items)
+        for batch in batches:
+            for i, m in zip(batch, self.decrypt_batch([items[i] for i in batch], check)):
+                out[i] = m
+        return out
+
+
+def test():
+    keys, decryptor = batch_key_gen(1024)
+    msgs = list(range(2, 40))
+    items = [(keys[i % 5][1], encrypt(m, keys[i % 5])) for i, m in enumerate(msgs)]
+    print(decryptor.decrypt_many(items) == msgs)
+    print(decryptor.decrypt_many(items, batch_size=3) == msgs)
+    key = decryptor.keys[keys[0][1]]
+    print(decryptor.decrypt_batch(items[:1]) == [decrypt(items[0][1], key)])
+
+
+def benchmark(keylength=1024, sizes=(1, 2, 4, 8), number=10):
+    """ Time of decryption per message against batch size (plain CRT decryption for comparison) """
+    keys, decryptor = batch_key_gen(keylength)
+    for b in sizes:
+        items = [(key[1], encrypt(i + 2, key)) for i, key in enumerate(keys[:b])]
+        decryptor.decrypt_batch(items)      # fill the caches
+        t_batch = timeit.timeit(lambda: decryptor.decrypt_batch(items), number=number) / number / b
+        t_plain = timeit.timeit(lambda: [decrypt(c, decryptor.keys[d]) for d, c in items], number=number) / number / b
+        print('%4d bits  batch %d  %8.3f ms / message  (plain %8.3f ms)' % (keylength, b, t_batch * 1000, t_plain * 1000))
+
+
+if __name__ == "__main__":
+    test()
+    benchmark()
@@ -0,0 +1,181 @@
+"""
+    Parallel RSA key generation and a reservoir of ready key pairs.
+
+    Primes are searched for in a pool of processes: every process sieves and tests its own random candidates,
+    the first one to find a prime stops the others.
+    KeyReservoir keeps up to *capacity* ready key pairs, generated in the background,
+    and starts refilling as soon as the number of ready keys drops to *low_water*,
+    so get_key() usually returns immediately.
+"""
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from rsa_studyv import key_gen, get_random_odd, miller_rabin_test, _sieve_window, SIEVE_WINDOW
+
+_stop = None    # event shared by all processes of the pool: set when a prime is found
+
+
+def _init_worker(stop):
+    global _stop
+    _stop = stop
+
+
+def _search_prime(size):
+    """ get_random_prime, that gives up as soon as another process has found a prime
+
+    :return: prime of bit length size or None
+    """
+    while not _stop.is_set():
+        for num in _sieve_window(get_random_odd(size), SIEVE_WINDOW):
+            if num.bit_length() != size or _stop.is_set():
+                break
+            if miller_rabin_test(num):
+                return num
+    return None
+
+
+class ParallelPrimeGenerator:
+    """
+    Callable object: generator(size) returns a random prime of given bit length,
+    searched for by *workers* processes at once (can be passed to key_gen as prime_gen)
+    """
+
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count()
+        self._stop = multiprocessing.Event()
+        self._lock = threading.Lock()   # one search at a time, they share the stop event
+        self._closed = False
+        self._pool = ProcessPoolExecutor(self.workers, initializer=_init_worker, initargs=(self._stop,))
+
+    def __call__(self, size):
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Prime generator was closed")
+            self._stop.clear()
+            prime = None
+            # wait for all tasks, so that none of them is left running into the next search
+            for task in as_completed([self._pool.submit(_search_prime, size) for _ in range(self.workers)]):
+                if prime is None and task.result() is not None:
+                    prime = task.result()
+                    self._stop.set()
+            if prime is None:
+                raise RuntimeError("Prime generator was closed")
+            return prime
+
+    def close(self):
+        self._closed = True
+        self._stop.set()            # the running search (if any) ends soon
+        with self._lock:
+            self._pool.shutdown()
+
+
+class KeyReservoir:
+    """
+    Bounded reservoir of RSA key pairs (the same as key_gen returns), refilled in a background thread.
+
+    metrics() reports the number of ready keys and the time it took to generate them.
+    """
+
+    def __init__(self, keylength=1024, capacity=8, low_water=2, workers=None):
+        """
+        :param keylength: size of N in bits
+        :param capacity: maximum number of ready keys
+        :param low_water: refilling starts when the number of ready keys is at most low_water
+        :param workers: number of processes searching for primes (os.cpu_count() if None)
+        """
+        assert 0 <= low_water < capacity
+        self.keylength = keylength
+        self.capacity = capacity
+        self.low_water = low_water
+        self._primes = ParallelPrimeGenerator(workers)
+        self._keys = deque()
+        self._latencies = deque(maxlen=1000)   # generation time of the last keys, in seconds
+        self._generated = 0
+        self._waits = 0                        # get_key() calls that found the reservoir empty
+        self._refilling = True
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._fill, daemon=True)
+        self._thread.start()
+
+    def _fill(self):
+        while True:
+            with self._cond:
+                while self._refilling is False and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+            start = time.perf_counter()
+            try:
+                key = key_gen(self.keylength, prime_gen=self._primes)
+            except RuntimeError:        # pool was shut down by close()
+                return
+            with self._cond:
+                self._keys.append(key)
+                self._generated += 1
+                self._latencies.append(time.perf_counter() - start)
+                if len(self._keys) >= self.capacity:
+                    self._refilling = False
+                self._cond.notify_all()
+
+    def get_key(self, timeout=None):
+        """
+        :param timeout: maximum time in seconds to wait for a key if the reservoir is empty (None - no limit)
+        :return: (public key, private key) or None if no key was ready in time
+        """
+        with self._cond:
+            if not self._keys:
+                self._waits += 1
+                self._refilling = True
+                self._cond.notify_all()
+                if not self._cond.wait_for(lambda: self._keys or self._closed, timeout) or not self._keys:
+                    return None
+            key = self._keys.popleft()
+            if len(self._keys) <= self.low_water:
+                self._refilling = True
+                self._cond.notify_all()
+            return key
+
+    def metrics(self):
+        """
+        :return: dict: depth - number of ready keys, generated - number of keys generated so far,
+                 mean_latency / max_latency - generation time of one key in seconds (over the last 1000 keys),
+                 waits - calls of get_key() that had to wait for a key
+        """
+        with self._cond:
+            lat = list(self._latencies)
+            return {'depth': len(self._keys),
+                    'generated': self._generated,
+                    'mean_latency': sum(lat) / len(lat) if lat else None,
+                    'max_latency': max(lat) if lat else None,
+                    'waits': self._waits}
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._primes.close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def test():
+    from rsa_studyv import encrypt, decrypt
+    with KeyReservoir(keylength=512, capacity=3, low_water=1, workers=2) as reservoir:
+        for _ in range(4):
+            public, private = reservoir.get_key()
+            n, d, e, p, q = private
+            print(n == p * q and decrypt(encrypt(12345, public), private) == 12345)
+        print(reservoir.metrics())
+
+
+if __name__ == "__main__":
+    test()
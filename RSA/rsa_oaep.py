@@ -11,7 +11,7 @@
 
 
 from Cryptography.SHA256.sha256 import SHA256 as SHA
-from Cryptography.RSA.rsa_studyv import encrypt, decrypt
+from Cryptography.RSA.rsa_studyv import encrypt, decrypt, batch_map, PrivateKey
 from os import urandom
 
 
@@ -31,10 +31,7 @@ def i2osp(x, xLen):
     :return: X: corresponding octet string of length l
     """
     assert x < 256 ** xLen
-    X = b''
-    for i in range(xLen - 1, -1, -1):
-        X += int.to_bytes((x >> (8 * i)) & 0xff, 1, 'big')
-    return X
+    return x.to_bytes(xLen, 'big')
 
 
 def os2ip(X):
@@ -47,11 +44,7 @@ def os2ip(X):
     :param X: octet string to be converted
     :return: x: nonnegative integer
     """
-    x = 0
-    xLen = len(X)
-    for i in range(xLen):
-        x += X[xLen - 1 - i] * 256 ** i
-    return x
+    return int.from_bytes(X, 'big')
 
 
 def mgf1(string, length):
@@ -102,7 +95,7 @@ def rsaes_oaep_encrypt(key, message):
     if mLen > k - 2 * hLen - 2:
         raise OverflowError("Message is too long")
     message_padded = os2ip(_eme_oaep_encoding(message))
-    enc = encrypt(message_padded, key)
+    enc = encrypt(message_padded, key, check=False)    # EM is built here, not taken from the outside
     return i2osp(enc, k)
 
 
@@ -134,9 +127,89 @@ def rsaes_oaep_decrypt(key, ciphertext):
             be verified; here it is always an empty string)
     :return: message, an octet string of length mLen, where mLen <= k - 2hLen - 2
     """
-    cLen = len(ciphertext)
-    if cLen != k or k < 2 * hLen + 2:
-        raise ValueError("Decryption Error")
+    _check_length(ciphertext)
     em = i2osp(decrypt(os2ip(ciphertext), key), k)
     m = _eme_oaep_decoding(em)
     return m
+
+
+def _check_length(ciphertext):
+    cLen = len(ciphertext)
+    if cLen != k or k < 2 * hLen + 2:
+        raise ValueError("Decryption Error")
+
+
+def rsaes_oaep_decrypt_batch(decryptor, items):
+    """ rsaes_oaep_decrypt for many ciphertexts at once with Fiat's batch RSA
+
+    Ciphertexts encrypted with different public keys (N, d_i) of one modulus are decrypted together,
+    at the cost of about one exponentiation per batch (see rsa_batch)
+
+    :param decryptor: rsa_batch.BatchDecryptor
+    :param items: iterable of (public exponent d_i, ciphertext) - octet strings of length k
+    :return: list of messages in the order of items
+    """
+    items = list(items)
+    for _, ciphertext in items:
+        _check_length(ciphertext)
+    ems = decryptor.decrypt_many([(d, os2ip(ciphertext)) for d, ciphertext in items])
+    return [_eme_oaep_decoding(i2osp(em, k)) for em in ems]
+
+
+def _encrypt_item(message, key):
+    return rsaes_oaep_encrypt(key, message)
+
+
+def _decrypt_item(ciphertext, key):
+    return rsaes_oaep_decrypt(key, ciphertext)
+
+
+def rsaes_oaep_encrypt_iter(key, messages, **kwargs):
+    """ iterator of rsaes_oaep_encrypt(key, m) for m in messages, in a pool of processes
+
+    Padding and exponentiation both run in the pool (see rsa_studyv.batch_map for kwargs)
+    """
+    return batch_map(_encrypt_item, tuple(key), messages, **kwargs)
+
+
+def rsaes_oaep_decrypt_iter(key, ciphertexts, **kwargs):
+    """ iterator of rsaes_oaep_decrypt(key, c) for c in ciphertexts, in a pool of processes
+
+    CRT parameters of the key are computed once. A decryption error stops the iteration
+    (see rsa_studyv.batch_map for kwargs)
+    """
+    if not isinstance(key, PrivateKey):
+        key = PrivateKey(*key)
+    key.precompute()
+    return batch_map(_decrypt_item, key, ciphertexts, **kwargs)
+
+
+def rsaes_oaep_encrypt_many(key, messages, **kwargs):
+    """ list of OAEP ciphertexts of messages """
+    return list(rsaes_oaep_encrypt_iter(key, messages, **kwargs))
+
+
+def rsaes_oaep_decrypt_many(key, ciphertexts, **kwargs):
+    """ list of messages decrypted from OAEP ciphertexts """
+    return list(rsaes_oaep_decrypt_iter(key, ciphertexts, **kwargs))
+
+
+def test():
+    from Cryptography.RSA.rsa_studyv import key_gen
+    from Cryptography.RSA.rsa_batch import batch_key_gen
+    messages = [urandom(i) for i in range(0, k - 2 * hLen - 1, 3)]
+
+    public, private = key_gen(8 * k, public_exponent=65537)
+    ciphertexts = [rsaes_oaep_encrypt(public, m) for m in messages]
+    print([rsaes_oaep_decrypt(private, c) for c in ciphertexts] == messages)
+    pooled = rsaes_oaep_encrypt_many(public, messages, workers=2, chunk_size=4)
+    print(rsaes_oaep_decrypt_many(private, pooled, workers=2, chunk_size=4) == messages)
+    print(list(rsaes_oaep_decrypt_iter(tuple(private), iter(ciphertexts), workers=2, max_pending=1)) == messages)
+
+    keys, decryptor = batch_key_gen(8 * k)
+    items = [(keys[i % 3][1], rsaes_oaep_encrypt(keys[i % 3], m)) for i, m in enumerate(messages)]
+    print(rsaes_oaep_decrypt_batch(decryptor, items) == messages)
+
+
+if __name__ == "__main__":
+    test()
@@ -1,5 +1,34 @@
+import math
 import os
 import random
+import timeit
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from functools import cached_property, partial
+from itertools import compress, islice
+
+SMALL_PRIMES_BOUND = 1 << 14   # candidates for primes are checked for divisibility by odd primes below this bound
+SIEVE_WINDOW = 1 << 11         # number of consecutive odd candidates sieved at once by get_random_prime
+BATCH_CHUNK = 32               # number of messages in one task of batch_map
+
+
+def _small_primes(n):
+    """ odd primes below n (Sieve of Eratosthenes over odd numbers, byte i stands for 2 * i + 1) """
+    sieve = bytearray([1]) * (n // 2)
+    sieve[0] = 0
+    for i in range(1, (math.isqrt(n) + 1) // 2):
+        if sieve[i]:
+            p = 2 * i + 1
+            sieve[p * p // 2::p] = bytes(len(range(p * p // 2, len(sieve), p)))
+    return list(compress(range(1, n, 2), sieve))
+
+
+_SMALL_PRIMES = _small_primes(SMALL_PRIMES_BOUND)
+_SMALL_PRIMES_SET = frozenset(_SMALL_PRIMES)
+# Miller-Rabin test with these bases is exact for all n < _DETERMINISTIC_BOUND
+_DETERMINISTIC_BASES = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41)
+_DETERMINISTIC_BOUND = 3317044064679887385961981
+_TRIAL_PRIMES = _SMALL_PRIMES[:100]   # primes used by miller_rabin_test for early rejection
 
 
 def euclidian_extended(a, b):
@@ -48,6 +77,226 @@ def fast_exp(x, y, z):
     return res
 
 
+def _window_size(bits):
+    # number of bits in a window: more precomputed powers pay off only for long exponents
+    if bits <= 64:
+        return 3
+    if bits <= 256:
+        return 4
+    if bits <= 768:
+        return 5
+    return 6
+
+
+def _recode(y, w):
+    """ Sliding window recoding of exponent y (it doesn't depend on the base, so it can be reused)
+
+    The exponent is read from the top bit: zero bits cost one squaring, a window of at most w bits
+    that ends with 1 costs (length of the window) squarings and one multiplication by x ** (window value).
+
+    :return: list of (number of squarings, index of the odd power x ** (2 * index + 1) to multiply by),
+             number of squarings after the last window
+    """
+    steps, squarings = [], 0
+    i = y.bit_length() - 1
+    while i >= 0:
+        if not (y >> i) & 1:
+            squarings += 1
+            i -= 1
+            continue
+        j = max(i - w + 1, 0)
+        while not (y >> j) & 1:
+            j += 1
+        steps.append((squarings + i - j + 1, ((y >> j) & ((1 << (i - j + 1)) - 1)) >> 1))
+        squarings = 0
+        i = j - 1
+    return steps, squarings
+
+
+def _sliding_window(x, y, mul, one, w, recoded=None):
+    """ Left-to-right sliding window exponentiation: x ** y, where multiplication is mul
+
+    Odd powers x, x ** 3, ..., x ** (2 ** w - 1) are precomputed, then the steps of _recode(y, w) are applied
+    (recoded may be given, if it was computed before).
+    """
+    x2 = mul(x, x)
+    table = [x]
+    for _ in range(2 ** (w - 1) - 1):
+        table.append(mul(table[-1], x2))
+    steps, tail = recoded or _recode(y, w)
+    res = one
+    for squarings, index in steps:
+        for _ in range(squarings):
+            res = mul(res, res)
+        res = mul(res, table[index])
+    for _ in range(tail):
+        res = mul(res, res)
+    return res
+
+
+def window_exp(x, y, z):
+    """ Sliding window modular exponentiation
+
+    :return: x ** y (mod z)
+    """
+    return _sliding_window(x % z, y, lambda a, b: a * b % z, 1 % z, _window_size(y.bit_length()))
+
+
+def montgomery_exp(x, y, z):
+    """ Sliding window modular exponentiation in Montgomery form (z should be odd)
+
+    Numbers are kept as a * R (mod z), R = 2 ** k > z. Product of two such numbers is reduced by REDC:
+        REDC(t) = (t + ((t mod R) * z' mod R) * z) / R,  z' = -z ** (-1) (mod R)
+    which needs only multiplications, masks and shifts instead of division by z.
+
+    :return: x ** y (mod z)
+    """
+    mul, k = _montgomery_mul(z)
+    res = _sliding_window((x << k) % z, y, mul, (1 << k) % z, _window_size(y.bit_length()))
+    return mul(res, 1)  # back from Montgomery form
+
+
+def _montgomery_mul(z):
+    """ :return: REDC multiplication modulo odd z, k (R = 2 ** k) """
+    assert z & 1
+    k = z.bit_length()
+    mask = (1 << k) - 1
+    z_prime = (1 << k) - euclidian_extended(z, 1 << k)[1]
+
+    def mul(a, b):
+        t = a * b
+        t = (t + ((t & mask) * z_prime & mask) * z) >> k
+        return t - z if t >= z else t
+
+    return mul, k
+
+
+class FixedBaseExp:
+    """ x ** y (mod z) for many exponents y and the same base x
+
+    Powers x ** (j * 2 ** (w * i)) for all j < 2 ** w are precomputed,
+    so exponentiation needs only one multiplication per w bits of y and no squarings.
+    """
+
+    def __init__(self, x, z, max_bits, w=4):
+        self.z, self.w, self.max_bits = z, w, max_bits
+        self.table = []
+        base = x % z
+        for _ in range(-(-max_bits // w)):
+            row = [1 % z]
+            for _ in range(2 ** w - 1):
+                row.append(row[-1] * base % z)
+            self.table.append(row)
+            base = row[-1] * base % z     # x ** (2 ** (w * (i + 1)))
+
+    def __call__(self, y):
+        assert y.bit_length() <= self.max_bits
+        res, mask, z = 1 % self.z, (1 << self.w) - 1, self.z
+        for row in self.table:
+            if not y:
+                break
+            res = res * row[y & mask] % z
+            y >>= self.w
+        return res
+
+
+class FixedExponentExp:
+    """ x ** y (mod z) for many bases x and the same exponent y and modulus z (e.g. CRT halves of a private key)
+
+    Work that doesn't depend on the base is done once: sliding window recoding of y
+    and constants of Montgomery form. It pays off with the 'window' and 'montgomery' engines,
+    with 'builtin' and 'binary' there is nothing to share and the engine is just called.
+    """
+
+    def __init__(self, y, z):
+        self.y, self.z = y, z
+        self.w = _window_size(y.bit_length())
+        self._recoded = None
+        self._montgomery = None
+
+    def __getstate__(self):
+        # REDC multiplication is a closure and can't be pickled (keys are sent to worker processes):
+        # it's rebuilt on first use after unpickling
+        state = self.__dict__.copy()
+        state['_montgomery'] = None
+        return state
+
+    def __call__(self, x):
+        y, z = self.y, self.z
+        if _modexp is window_exp or _modexp is montgomery_exp:
+            if self._recoded is None:
+                self._recoded = _recode(y, self.w)
+            if _modexp is window_exp:
+                return _sliding_window(x % z, y, lambda a, b: a * b % z, 1 % z, self.w, self._recoded)
+            if self._montgomery is None:
+                self._montgomery = _montgomery_mul(z)
+            mul, k = self._montgomery
+            return mul(_sliding_window((x << k) % z, y, mul, (1 << k) % z, self.w, self._recoded), 1)
+        return _modexp(x % z, y, z)
+
+
+# modular exponentiation used by encrypt, decrypt and miller_rabin_test (see set_modexp_engine)
+MODEXP_ENGINES = {
+    'builtin': pow,            # CPython's pow (C implementation, also uses windows)
+    'binary': fast_exp,
+    'window': window_exp,
+    'montgomery': montgomery_exp,
+}
+_modexp = pow
+
+
+def set_modexp_engine(name):
+    """ Choose modular exponentiation for RSA operations: 'builtin', 'binary', 'window' or 'montgomery'
+    (run benchmark_modexp() to find the fastest one on the platform)
+    """
+    global _modexp
+    _modexp = MODEXP_ENGINES[name]
+
+
+def benchmark_modexp(sizes=(1024, 2048, 4096), number=3):
+    """
+    Latency of one x ** y (mod z) with full-size x, y, z for each engine (and FixedBaseExp after precomputation)
+    """
+    for bits in sizes:
+        z = get_random_odd(bits)
+        x, y = random.getrandbits(bits) % z, random.getrandbits(bits)
+        expected = pow(x, y, z)
+        fixed = FixedBaseExp(x, z, bits)
+        engines = dict(MODEXP_ENGINES, fixed_base=lambda a, b, c: fixed(b))
+        for name, f in engines.items():
+            assert f(x, y, z) == expected
+            t = timeit.timeit(lambda: f(x, y, z), number=number) / number
+            print('%4d bits  %-10s %10.3f ms' % (bits, name, t * 1000))
+
+
+def _trial_division(n):
+    """ :return: True / False if primality of n is decided by small primes, None - otherwise """
+    if n < 2:
+        return False
+    if n % 2 == 0:
+        return n == 2
+    if n in _SMALL_PRIMES_SET:
+        return True
+    for p in _TRIAL_PRIMES:
+        if n % p == 0:
+            return False
+    return None
+
+
+def _strong_probable_prime(n, a, m, s):
+    """ one round of Miller-Rabin test with base a (n - 1 = m * 2 ** s) """
+    b = _modexp(a, m, n)  # b = a ** m (mod n)    (if n is prime then b could be 1 or -1)
+    if b == 1 or b == n - 1:
+        return True
+    for _ in range(s - 1):  # check if b = a ** (2 ** r) * d = -1 for any r < s
+        b = (b * b) % n
+        if b == n - 1:
+            return True
+        if b == 1:
+            return False
+    return False
+
+
 def miller_rabin_test(n):
     """ Miller-Rabin primality test
 
@@ -57,15 +306,23 @@ def miller_rabin_test(n):
       - a ** (m * 2 ** r) = -1 (mod n) for some r < s
     If for some a none of the above is true, then n isn't prime and a is called a witness of compositness of n
 
+    Cheap checks go first: divisibility by small primes, then base 2 (most composites fail it).
+    For n < 3.3 * 10 ** 24 the fixed bases 2, 3, ..., 41 make the answer exact,
+    for larger n random bases are used.
+
     :param n: integer to be tested for primality
     :return: True if n is prime, False - otherwise
     """
+    res = _trial_division(n)
+    if res is not None:
+        return res
     s, m = 0, n - 1  # set s and m, according to n - 1 = m * 2**s
     while m % 2 == 0:
         m //= 2
         s += 1
-    if s == 0:
-        return False  # if n isn't odd then obviously it's not prime
+
+    if n < _DETERMINISTIC_BOUND:
+        return all(_strong_probable_prime(n, a, m, s) for a in _DETERMINISTIC_BASES)
 
     n_length = n.bit_length()
     if n_length >= 1024:
@@ -76,19 +333,91 @@ def miller_rabin_test(n):
         K = 17
     else:
         K = 20
-    for _ in range(K):
-        a = random.randint(2, n - 2)
-        b = fast_exp(a, m, n)  # b = a ** m (mod n)    (if n is prime then b could be 1 or -1)
-        if b != 1 and b != n - 1:
-            i = 1
-            while i < s and b != n - 1:  # check if b = a ** (2 ** r) * d = -1 for any r < s
-                b = (b * b) % n
-                if b == 1: return False
-                i += 1
-            if b != n - 1: return False
+    if not _strong_probable_prime(n, 2, m, s):
+        return False
+    for _ in range(K - 1):
+        if not _strong_probable_prime(n, random.randint(3, n - 2), m, s):
+            return False
     return True
 
 
+def _jacobi(a, n):
+    """ Jacobi symbol (a / n), n - odd positive """
+    a %= n
+    res = 1
+    while a:
+        while a % 2 == 0:
+            a //= 2
+            if n % 8 in (3, 5):
+                res = -res
+        a, n = n, a
+        if a % 4 == 3 and n % 4 == 3:
+            res = -res
+        a %= n
+    return res if n == 1 else 0
+
+
+def _strong_lucas_test(n):
+    """ Strong Lucas probable prime test with Selfridge parameters
+
+    D - first of 5, -7, 9, -11, ... with Jacobi symbol (D / n) = -1,  P = 1,  Q = (1 - D) / 4
+    n + 1 = d * 2 ** s. n is a strong Lucas probable prime if U_d = 0 (mod n) or V_(d * 2 ** r) = 0 (mod n)
+    for some r < s, where U, V are Lucas sequences:
+        U_2k = U_k * V_k,  V_2k = V_k ** 2 - 2 * Q ** k
+        U_(k+1) = (P * U_k + V_k) / 2,  V_(k+1) = (D * U_k + P * V_k) / 2
+    """
+    if math.isqrt(n) ** 2 == n:     # for squares (D / n) is never -1
+        return False
+    D = 5
+    while True:
+        j = _jacobi(D, n)
+        if j == -1:
+            break
+        if j == 0 and abs(D) != n:
+            return False
+        D = -D - 2 if D > 0 else -D + 2
+    Q = (1 - D) // 4
+    d, s = n + 1, 0
+    while d % 2 == 0:
+        d //= 2
+        s += 1
+
+    U, V, Qk = 1, 1, Q % n      # k = 1
+    for bit in bin(d)[3:]:
+        U, V, Qk = U * V % n, (V * V - 2 * Qk) % n, Qk * Qk % n
+        if bit == '1':
+            U, V = U + V, D * U + V
+            U = (U + n if U % 2 else U) // 2 % n
+            V = (V + n if V % 2 else V) // 2 % n
+            Qk = Qk * Q % n
+    if U == 0 or V == 0:
+        return True
+    for _ in range(s - 1):
+        V, Qk = (V * V - 2 * Qk) % n, Qk * Qk % n
+        if V == 0:
+            return True
+    return False
+
+
+def baillie_psw_test(n):
+    """ Baillie-PSW primality test: Miller-Rabin with base 2 and strong Lucas test
+
+    No composite number passing it is known (and there are none below 2 ** 64),
+    while it costs about as much as 3 rounds of Miller-Rabin test.
+
+    :param n: integer to be tested for primality
+    :return: True if n is (probably) prime, False - otherwise
+    """
+    res = _trial_division(n)
+    if res is not None:
+        return res
+    s, m = 0, n - 1
+    while m % 2 == 0:
+        m //= 2
+        s += 1
+    return _strong_probable_prime(n, 2, m, s) and _strong_lucas_test(n)
+
+
 def get_random_odd(size):
     """ Generates random odd integer of desired size
 
@@ -104,74 +433,285 @@ def get_random_odd(size):
     return num
 
 
-def get_random_prime(size):
+def _sieve_window(start, length):
+    """ Candidates start, start + 2, ..., start + 2 * (length - 1) (start is odd),
+    that have no prime factors below SMALL_PRIMES_BOUND (except the prime itself)
+
+    For each small prime p only the first multiple in the window is found with one division,
+    the rest are crossed out with a slice assignment, no big-number arithmetic per candidate.
+    """
+    alive = bytearray([1]) * length
+    for p in _SMALL_PRIMES:
+        # start + 2 * i = 0 (mod p)  <=>  i = -start * 2^(-1) (mod p),  2^(-1) = (p + 1) / 2 (mod p)
+        i = (p - start % p) * ((p + 1) // 2) % p
+        if start + 2 * i == p:
+            i += p
+        alive[i::p] = bytes(len(range(i, length, p)))
+    return (start + 2 * i for i in compress(range(length), alive))
+
+
+def get_random_prime(size, primality_test=miller_rabin_test):
     """ Generate random prime number of specified size
 
+    Starting from a random odd number, a window of consecutive odd numbers is sieved by small primes,
+    and only the remaining candidates go to the primality test
+    (most candidates have a small factor, so most modular exponentiations are avoided).
+
     :param size: bit length of prime to be generated
+    :param primality_test: miller_rabin_test or baillie_psw_test
     :return:
     """
     while True:
-        num = get_random_odd(size)
-        if miller_rabin_test(num):
-            return num
+        for num in _sieve_window(get_random_odd(size), SIEVE_WINDOW):
+            if num.bit_length() != size:
+                break
+            if primality_test(num):
+                return num
+
+
+class PrivateKey(namedtuple('PrivateKey', ['n', 'd', 'e', 'p', 'q'])):
+    """ RSA private key (N, d, e, p, q) with precomputed parameters for the Chinese remainder theorem:
+
+    dp = e mod (p - 1),  dq = e mod (q - 1),  q_inv = q ** (-1) mod p
+
+    It is still a tuple, so it can be unpacked as before: N, d, e, p, q = key
+    The parameters are computed on first use and cached, so keys made by _make / _replace get them too.
+    """
 
+    @cached_property
+    def dp(self):
+        return self.e % (self.p - 1)
 
-def key_gen(keylength=1024):
+    @cached_property
+    def dq(self):
+        return self.e % (self.q - 1)
+
+    @cached_property
+    def q_inv(self):
+        return euclidian_extended(self.q, self.p)[1]
+
+    @cached_property
+    def _exp_p(self):
+        return FixedExponentExp(self.dp, self.p)
+
+    @cached_property
+    def _exp_q(self):
+        return FixedExponentExp(self.dq, self.q)
+
+    def precompute(self):
+        """ compute all CRT parameters now (e.g. before the key is sent to other processes)
+
+        :return: the key itself
+        """
+        for name in ('dp', 'dq', 'q_inv', '_exp_p', '_exp_q'):
+            getattr(self, name)
+        return self
+
+
+def _crt_exp(x, key):
+    """ x ** e (mod N) for private key (N, d, e, p, q) via the Chinese remainder theorem
+
+    Two exponentiations with half-size moduli and exponents instead of one full-size:
+        m1 = x ** dp (mod p),  m2 = x ** dq (mod q)
+    and the result is recombined with Garner's formula:
+        h = q_inv * (m1 - m2) (mod p),  m = m2 + h * q
+    Exponent recoding and Montgomery constants are kept in the key (see FixedExponentExp)
+    """
+    m1 = key._exp_p(x)
+    m2 = key._exp_q(x)
+    h = key.q_inv * (m1 - m2) % key.p
+    return m2 + h * key.q
+
+
+def key_gen(keylength=1024, prime_gen=get_random_prime, public_exponent=None):
     """ Function that generates public and private key-pairs for RSA
 
     :param keylength: desired size of N = pq - public parameter
-    :return: (N, d) - public key and (N, d, e, p, q) - private key
+    :param prime_gen: function that returns a random prime of given bit length
+    :param public_exponent: fixed public exponent d (usually 65537 - encryption is then 17 squarings),
+                            if None - d is a random prime greater than max(p, q)
+    :return: (N, d) - public key and (N, d, e, p, q) - private key (PrivateKey)
     """
+    # phi(N) is even, so an even d is never invertible
+    if public_exponent is not None and (public_exponent < 3 or public_exponent % 2 == 0):
+        raise ValueError("Public exponent should be odd and at least 3")
     # generate two different random primes so that their product has given length (approximately)
 
+    p_length = keylength // 2
     while True:
-        p_length = keylength // 2
-        p = get_random_prime(p_length)
-        q = get_random_prime(p_length)
-        if p != q:
+        p = prime_gen(p_length)
+        q = prime_gen(p_length)
+        if p == q:
+            continue
+        # fixed d should be coprime with phi(n)
+        if public_exponent is None or euclidian_extended(public_exponent, (p - 1) * (q - 1))[0] == 1:
             break
 
     n = p * q
     phi = (p - 1) * (q - 1)
-    # according to R.L. Rivest, A. Shamir, and L. Adleman
-    # it's enough to take d prime and greater than max(p, q)
-    # then gcd(d, phi(n)) = 1
-    d_size = random.randint(p_length + 1, keylength - 1)
-    d = get_random_prime(d_size)
+    if public_exponent is None:
+        # according to R.L. Rivest, A. Shamir, and L. Adleman
+        # it's enough to take d prime and greater than max(p, q)
+        # then gcd(d, phi(n)) = 1
+        d_size = random.randint(p_length + 1, keylength - 1)
+        d = prime_gen(d_size)
+    else:
+        d = public_exponent
     _, e = euclidian_extended(d, phi)
-    return (n, d), (n, d, e, p, q)
+    return (n, d), PrivateKey(n, d, e, p, q)
 
 
-def encrypt(ptext, key):
+def encrypt(ptext, key, check=True):
     """ RSA encryption with public key *key*
 
     :param ptext: message to be encrypted
     :param key: public key
+    :param check: check that the message is coprime with N
+                  (can be skipped for trusted input, e.g. OAEP-encoded messages)
     :return: ciphertext (integer)
     """
     if isinstance(ptext, bytes):
         ptext = int.from_bytes(ptext, byteorder='big')
     N, d = key
-    if ptext >= N or euclidian_extended(ptext, N)[0] != 1:
+    if ptext >= N or check and euclidian_extended(ptext, N)[0] != 1:
         raise OverflowError("Message could not be encrypted")
-    ctext = fast_exp(ptext, d, N)
+    ctext = _modexp(ptext, d, N)
     # return int.to_bytes(ctext, byteorder='big', length=ctext.bit_length() // 8 + 1)
     return ctext
 
 
-def decrypt(ctext, key):
+def decrypt(ctext, key, check=True):
     """ RSA decryption
 
     :param ctext: message to be decrypted
-    :param key: private key (N, d, e, p, q)
+    :param key: private key (N, d, e, p, q) - PrivateKey or plain tuple
+    :param check: check that the ciphertext is coprime with N (can be skipped for trusted input)
     :return: decrypted message (integer)
     """
     if isinstance(ctext, bytearray):
         ctext = int.from_bytes(ctext, byteorder='big')
-    N, _, e, _, _ = key
-    if ctext >= N or euclidian_extended(ctext, N)[0] != 1:
+    if not isinstance(key, PrivateKey):
+        key = PrivateKey(*key)
+    N = key.n
+    if ctext >= N or check and euclidian_extended(ctext, N)[0] != 1:
         raise Exception("Message could not be encrypted")
-    ptext = fast_exp(ctext, e, N)
+    ptext = _crt_exp(ctext, key)
     # return int.to_bytes(ptext, byteorder='big', length=ptext.bit_length() // 8 + 1)
     return ptext
 
+
+# ============= BATCH OPERATIONS =============
+_batch = None   # (function, key) of the batch processed by this worker
+
+
+def _init_batch_worker(func, key, modexp):
+    global _batch, _modexp
+    _batch = func, key
+    _modexp = modexp    # the engine chosen in the parent process
+
+
+def _batch_chunk(chunk):
+    func, key = _batch
+    return [func(x, key) for x in chunk]
+
+
+def batch_map(func, key, items, workers=None, chunk_size=BATCH_CHUNK, max_pending=None):
+    """ func(item, key) for a stream of items under one key in a pool of processes
+
+    The key is sent to every process once (not with every task), items are read from the iterable lazily,
+    chunk_size at a time, and at most max_pending chunks are being processed at once,
+    so the input may be unbounded. With workers=1 items are processed in this process.
+    (The scheduling is the same as in hmac_sha256.verify_many: RSA and SHA are separate directories
+    without a shared module to keep it in.)
+
+    :param func: picklable function (item, key) -> result, e.g. encrypt or decrypt
+    :param workers: number of processes (os.cpu_count() if None)
+    :param chunk_size: number of items in one task
+    :param max_pending: number of tasks submitted, but not yet returned (2 * workers if None)
+    :return: iterator of results in the order of items
+    """
+    workers = workers or os.cpu_count()
+    if workers == 1:
+        yield from (func(x, key) for x in items)
+        return
+    max_pending = max_pending or 2 * workers
+    items = iter(items)
+    with ProcessPoolExecutor(workers, initializer=_init_batch_worker, initargs=(func, key, _modexp)) as pool:
+        pending = deque()
+        while True:
+            chunk = list(islice(items, chunk_size))
+            if chunk:
+                pending.append(pool.submit(_batch_chunk, chunk))
+            if not pending:
+                break
+            if not chunk or len(pending) >= max_pending:
+                yield from pending.popleft().result()
+
+
+def iter_encrypt(key, messages, check=True, **kwargs):
+    """ iterator of encrypt(m, key) for m in messages (see batch_map for kwargs) """
+    return batch_map(partial(encrypt, check=check), tuple(key), messages, **kwargs)
+
+
+def iter_decrypt(key, ciphertexts, check=True, **kwargs):
+    """ iterator of decrypt(c, key) for c in ciphertexts, CRT parameters are computed once (see batch_map for kwargs) """
+    if not isinstance(key, PrivateKey):
+        key = PrivateKey(*key)
+    key.precompute()    # sent to the workers with the key
+    return batch_map(partial(decrypt, check=check), key, ciphertexts, **kwargs)
+
+
+def encrypt_many(key, messages, check=True, **kwargs):
+    """ list of ciphertexts of messages under public key *key* """
+    return list(iter_encrypt(key, messages, check, **kwargs))
+
+
+def decrypt_many(key, ciphertexts, check=True, **kwargs):
+    """ list of plaintexts of ciphertexts under private key *key* """
+    return list(iter_decrypt(key, ciphertexts, check, **kwargs))
+
+
+def test():
+    # strong pseudoprimes to several bases (3215031751: bases 2, 3, 5, 7),
+    # strong Lucas pseudoprimes (5459, 5777), Carmichael numbers (561, 41041)
+    for n in (3215031751, 2152302898747, 3825123056546413051, 5459, 5777, 10877, 561, 41041):
+        print(not miller_rabin_test(n) and not baillie_psw_test(n))
+    primes = _small_primes(10000)
+    print(all(miller_rabin_test(n) == baillie_psw_test(n) == (n in primes) for n in range(3, 10000, 2)))
+    p = (1 << 127) - 1
+    print(miller_rabin_test(p) and baillie_psw_test(p) and not baillie_psw_test(p * 131071))
+
+    public, private = key_gen(512)
+    m = 123456789
+    c = encrypt(m, public)
+    print(decrypt(c, private) == decrypt(c, tuple(private)) == decrypt(c, private._replace(d=private.d)) == m)
+    print(decrypt(encrypt(m, public, check=False), private, check=False) == m)
+
+    public, private = key_gen(512, public_exponent=65537)
+    print(public[1] == 65537 and decrypt(encrypt(m, public), private) == m)
+
+    messages = list(range(2, 200))
+    ciphertexts = encrypt_many(public, messages, workers=2, chunk_size=7)
+    print(ciphertexts == [encrypt(x, public) for x in messages])
+    print(decrypt_many(tuple(private), ciphertexts, workers=2, chunk_size=7) == messages)
+    print(list(batch_map(pow, 3, iter(messages), workers=2, chunk_size=5, max_pending=1)) ==
+          [x ** 3 for x in messages])
+
+    # every exponentiation engine, and keys used by it can still be sent to other processes
+    import pickle
+    z = get_random_odd(300)
+    x, y = random.getrandbits(300) % z, random.getrandbits(300)
+    fixed_base = FixedBaseExp(x, z, 300)
+    for name, f in MODEXP_ENGINES.items():
+        set_modexp_engine(name)
+        ok = f(x, y, z) == pow(x, y, z) == fixed_base(y) == FixedExponentExp(y, z)(x)
+        public, private = key_gen(256)
+        c = encrypt(m, public)
+        ok &= decrypt(c, private) == m and decrypt(c, pickle.loads(pickle.dumps(private))) == m
+        print(ok)
+    set_modexp_engine('builtin')
+
+
+if __name__ == "__main__":
+    test()
+    benchmark_modexp()
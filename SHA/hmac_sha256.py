@@ -1,10 +1,18 @@
 import hashlib
 import hmac
+import os
+from collections import deque
+from itertools import islice
 from sha256 import SHA256
 
 
 BLOCK_SIZE = 64
 OUTPUT = 32
+VERIFY_CHUNK = 1000  # records in one task of verify_many
+
+# translation tables: byte x -> x ^ ipad, x -> x ^ opad
+_IPAD = bytes(x ^ 0x36 for x in range(2 ** 8))
+_OPAD = bytes(x ^ 0x5c for x in range(2 ** 8))
 
 
 class HMAC_sha256:
@@ -21,27 +29,41 @@ class HMAC_sha256:
         opad - the block-sized outer padding, consisting of repeated bytes valued 0x5c
         ipad - the block-sized inner padding, consisting of repeated bytes valued 0x36
 
+    K' ^ ipad and K' ^ opad are exactly one block each, so they are hashed once, when the object is created:
+    the inner hash object then gets the message through update(), and the saved outer state
+    needs only one more block to finish. To authenticate many messages with the same key,
+    create one object and use copy() of it for every message.
     """
-    def __init__(self, key, message):
-        self.key = key
-        self.message = message
+    def __init__(self, key, message=b''):
+        key = bytes(key)
+        if len(key) > BLOCK_SIZE:
+            key = SHA256(key).digest()
+        K = key + (0).to_bytes(BLOCK_SIZE - len(key), 'big')
+        self._inner = SHA256(K.translate(_IPAD))
+        self._outer = SHA256(K.translate(_OPAD))
+        self.update(message)
 
     def update(self, m):
-        self.message += m
+        self._inner.update(m)
+
+    @property
+    def midstates(self):
+        """
+        (inner, outer) - SHA-256 states after hashing K' ^ ipad and K' ^ opad
+        (for an object that has got no message yet), see sha256.compress
+        """
+        return self._inner.state, self._outer.state
+
+    def copy(self):
+        other = HMAC_sha256.__new__(HMAC_sha256)
+        other._inner = self._inner.copy()
+        other._outer = self._outer      # never changed after __init__
+        return other
 
     def _digest(self):
-        ipad = (0x36).to_bytes(1, 'big') * BLOCK_SIZE
-        opad = (0x5c).to_bytes(1, 'big') * BLOCK_SIZE
-        if len(self.key) > BLOCK_SIZE:
-            temp = SHA256(self.key).digest()
-            K = temp + (0).to_bytes(BLOCK_SIZE - OUTPUT, 'big')
-        elif (len(self.key)) < BLOCK_SIZE:
-            K = self.key + (0).to_bytes(BLOCK_SIZE - len(self.key), 'big')
-        else:
-            K = self.key
-        s_i = bytearray([k ^ i for k, i in zip(K, ipad)])
-        s_0 = bytearray([k ^ o for k, o in zip(K, opad)])
-        return SHA256(s_0 + SHA256(s_i + self.message).digest())
+        outer = self._outer.copy()
+        outer.update(self._inner.digest())
+        return outer
 
     def digest(self):
         return self._digest().digest()
@@ -49,6 +71,17 @@ class HMAC_sha256:
     def hexdigest(self):
         return self._digest().hexdigest()
 
+    def verify(self, hmac_v):
+        """ Compare hmac value of the message with hmac_v in constant time
+        (time of comparison doesn't depend on the position of the first different byte)
+
+        :param hmac_v: expected hmac value (bytes-like object)
+        :return: True if they are equal, False - otherwise (also if hmac_v is not bytes-like, e.g. a hex string)
+        """
+        if not isinstance(hmac_v, (bytes, bytearray, memoryview)):
+            return False
+        return hmac.compare_digest(self.digest(), hmac_v)
+
 
 def message_authentification(message, key, hmac_v):
     """ If the receiver gets a message and wants to know whether it had not been corrupted
@@ -60,7 +93,63 @@ def message_authentification(message, key, hmac_v):
     :param hmac_v: hmac value of the original message
     :return: True if the message is unchanged, False - otherwise
     """
-    return HMAC_sha256(key, message).digest() == hmac_v
+    return HMAC_sha256(key, message).verify(hmac_v)
+
+
+# ============= BULK VERIFICATION =============
+_worker_keys = {}    # key id -> secret key
+_worker_macs = {}    # key id -> HMAC_sha256 object with precomputed pads (created on first use)
+
+
+def _init_verifier(keys):
+    global _worker_keys, _worker_macs
+    _worker_keys, _worker_macs = keys, {}
+
+
+def _verify_chunk(chunk):
+    res = []
+    for key_id, message, hmac_v in chunk:
+        mac = _worker_macs.get(key_id)
+        if mac is None:
+            if key_id not in _worker_keys:
+                res.append(False)
+                continue
+            mac = _worker_macs[key_id] = HMAC_sha256(_worker_keys[key_id])
+        mac = mac.copy()
+        mac.update(message)
+        res.append(mac.verify(hmac_v))
+    return res
+
+
+def verify_many(records, keys, workers=None, chunk_size=VERIFY_CHUNK, max_pending=None):
+    """ message_authentification for a stream of records in a pool of processes
+
+    Records are read from the iterable lazily, chunk_size at a time, and at most max_pending chunks
+    are being verified at once, so records don't have to fit in memory.
+    Every process keeps HMAC objects with precomputed pads for the keys it has seen.
+
+    :param records: iterable of (key id, message, hmac value)
+    :param keys: dict: key id -> secret key
+    :param workers: number of processes (os.cpu_count() if None)
+    :param chunk_size: number of records in one task
+    :param max_pending: number of tasks submitted, but not yet returned (2 * workers if None)
+    :return: iterator of results of verification (True / False, False for unknown key id)
+             in the order of records
+    """
+    from concurrent.futures import ProcessPoolExecutor     # not needed by most users of the module
+    workers = workers or os.cpu_count()
+    max_pending = max_pending or 2 * workers
+    records = iter(records)
+    with ProcessPoolExecutor(workers, initializer=_init_verifier, initargs=(dict(keys),)) as pool:
+        pending = deque()
+        while True:
+            chunk = list(islice(records, chunk_size))
+            if chunk:
+                pending.append(pool.submit(_verify_chunk, chunk))
+            if not pending:
+                break
+            if not chunk or len(pending) >= max_pending:
+                yield from pending.popleft().result()
 
 
 def test_hmac():
@@ -70,6 +159,23 @@ def test_hmac():
     print(a.digest() == hmac.new(secret, msg, digestmod=hashlib.sha256).digest())
     print(a.hexdigest() == hmac.new(secret, msg, digestmod=hashlib.sha256).hexdigest())
 
+    keyed = HMAC_sha256(secret * 30)    # key longer than block
+    for m in (b'', msg[:10], msg):
+        b = keyed.copy()
+        b.update(m)
+        print(b.verify(hmac.new(secret * 30, m, digestmod=hashlib.sha256).digest()))
+
+    keys = {i: os.urandom(i + 1) for i in range(5)}
+    records, expected = [], []
+    for i in range(300):
+        key_id, m = i % 7, os.urandom(i % 100)      # key ids 5 and 6 are unknown
+        hmac_v = hmac.new(keys.get(key_id, b''), m, digestmod=hashlib.sha256).digest()
+        if i % 3 == 0:
+            hmac_v = hmac_v[::-1]
+        records.append((key_id, m, hmac_v))
+        expected.append(key_id in keys and i % 3 != 0)
+    print(list(verify_many(iter(records), keys, workers=2, chunk_size=7, max_pending=1)) == expected)
+
 
 if __name__ == "__main__":
     test_hmac()
@@ -0,0 +1,132 @@
+"""
+    Key derivation functions based on HMAC-SHA256:
+     - PBKDF2 (RFC 8018) - derives keys from passwords, slowed down by the number of iterations
+     - HKDF (RFC 5869) - derives many keys from one master key (extract-then-expand)
+"""
+import hashlib
+import hmac
+import os
+import timeit
+from concurrent.futures import ProcessPoolExecutor
+from struct import pack
+from hmac_sha256 import HMAC_sha256, OUTPUT
+from sha256 import compress
+
+# padding of the last block of the inner and the outer hash in PBKDF2 iterations:
+# both hash (64-byte key block || 32-byte value), so the block is value || 1 || 0..0 || 768
+_PAD_96 = (128).to_bytes(1, 'big') + bytes(64 - OUTPUT - 9) + (96 * 8).to_bytes(8, 'big')
+
+
+def pbkdf2(password, salt, iterations, dklen=OUTPUT):
+    """ PBKDF2-HMAC-SHA256
+
+    DK = T_1 || T_2 || ... (first dklen bytes), where
+        T_i = U_1 ^ U_2 ^ ... ^ U_c,  c - number of iterations
+        U_1 = HMAC(password, salt || INT(i)),  U_j = HMAC(password, U_(j-1))
+
+    U_j is always 32 bytes, so HMAC(password, U_(j-1)) is exactly one compression starting from
+    the saved inner state and one compression starting from the saved outer state.
+
+    :param password: bytes
+    :param salt: bytes
+    :param iterations: number of iterations c
+    :param dklen: length of derived key in bytes
+    :return: derived key
+    """
+    keyed = HMAC_sha256(password)
+    inner, outer = keyed.midstates
+    res = b''
+    i = 1
+    while len(res) < dklen:
+        mac = keyed.copy()
+        mac.update(salt + i.to_bytes(4, 'big'))
+        u = mac.digest()
+        t = int.from_bytes(u, 'big')
+        for _ in range(iterations - 1):
+            u = pack('>8I', *compress(outer, pack('>8I', *compress(inner, u + _PAD_96)) + _PAD_96))
+            t ^= int.from_bytes(u, 'big')
+        res += t.to_bytes(OUTPUT, 'big')
+        i += 1
+    return res[:dklen]
+
+
+def hkdf_extract(salt, ikm):
+    """
+    :param salt: optional salt (b'' or None - string of 32 zeros)
+    :param ikm: input keying material (master key)
+    :return: PRK = HMAC(salt, IKM) - pseudorandom key
+    """
+    return HMAC_sha256(salt or bytes(OUTPUT), ikm).digest()
+
+
+def hkdf_expand(prk, info=b'', length=OUTPUT):
+    """
+    OKM = T(1) || T(2) || ... (first length bytes), where
+        T(0) = b'',  T(i) = HMAC(PRK, T(i - 1) || info || i)
+
+    :param prk: pseudorandom key (output of hkdf_extract)
+    :param info: context information (e.g. tenant id), different info gives independent keys
+    :param length: length of output keying material (at most 255 * 32)
+    :return: output keying material
+    """
+    assert length <= 255 * OUTPUT
+    keyed = HMAC_sha256(prk)
+    okm, t = b'', b''
+    for i in range(1, -(-length // OUTPUT) + 1):
+        mac = keyed.copy()
+        mac.update(t + info + i.to_bytes(1, 'big'))
+        t = mac.digest()
+        okm += t
+    return okm[:length]
+
+
+def hkdf(ikm, salt=b'', info=b'', length=OUTPUT):
+    """ HKDF-SHA256: hkdf_expand(hkdf_extract(salt, ikm), info, length) """
+    return hkdf_expand(hkdf_extract(salt, ikm), info, length)
+
+
+def _pbkdf2_task(args):
+    return pbkdf2(*args)
+
+
+def pbkdf2_many(items, iterations, dklen=OUTPUT, workers=None):
+    """ PBKDF2 for many (password, salt) pairs in a pool of processes
+
+    :param items: iterable of (password, salt)
+    :param workers: number of processes (os.cpu_count() if None)
+    :return: list of derived keys in the order of items
+    """
+    with ProcessPoolExecutor(workers) as pool:
+        return list(pool.map(_pbkdf2_task, ((p, s, iterations, dklen) for p, s in items)))
+
+
+def test():
+    for password, salt, c, dklen in ((b'password', b'salt', 1, 32), (b'password', b'salt', 4096, 32),
+                                     (b'passwordPASSWORDpassword', b'saltSALTsaltSALTsaltSALTsaltSALTsalt', 100, 40),
+                                     (b'k' * 100, b'', 3, 70)):
+        print(pbkdf2(password, salt, c, dklen) == hashlib.pbkdf2_hmac('sha256', password, salt, c, dklen))
+
+    # RFC 5869, test case 1
+    okm = hkdf(bytes.fromhex('0b' * 22), bytes.fromhex('000102030405060708090a0b0c'),
+               bytes.fromhex('f0f1f2f3f4f5f6f7f8f9'), 42)
+    print(okm.hex() == '3cb25f25faacd57a90434f64d0362f2a2d2d0a90cf1a5a4c5db02d56ecc4c5bf34007208d5b887185865')
+    prk = hkdf_extract(b'salt', b'master key')
+    print(hkdf_expand(prk, b'tenant-1', 16) == hmac.new(prk, b'tenant-1\x01', hashlib.sha256).digest()[:16])
+
+    items = [(b'password %d' % i, os.urandom(16)) for i in range(4)]
+    print(pbkdf2_many(items, 10) == [hashlib.pbkdf2_hmac('sha256', p, s, 10) for p, s in items])
+
+
+def benchmark(iterations=2000):
+    """
+    PBKDF2 iterations per second (compared with hashlib)
+    """
+    own = iterations / timeit.timeit(lambda: pbkdf2(b'password', b'salt', iterations), number=1)
+    ref = iterations / timeit.timeit(lambda: hashlib.pbkdf2_hmac('sha256', b'password', b'salt', iterations), number=1)
+    print('pbkdf2:  %10.0f iterations/s' % own)
+    print('hashlib: %10.0f iterations/s' % ref)
+
+
+if __name__ == "__main__":
+    test()
+    benchmark()
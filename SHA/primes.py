@@ -1,24 +1,75 @@
+import bisect
 import math
+from itertools import compress
+
+
+# primes found so far: all primes below _sieved (extended when a larger bound is asked for)
+_primes = []
+_sieved = 2
+SEGMENT = 1 << 18  # numbers covered by one segment of the segmented sieve
+
+
+def _odd_sieve(n):
+    """ Sieve of Eratosthenes over odd numbers only: byte i of the sieve stands for 2 * i + 1
+
+    :return: list of primes below n
+    """
+    if n <= 2:
+        return []
+    sieve = bytearray([1]) * (n // 2)
+    sieve[0] = 0    # 1 isn't prime
+    for i in range(1, (math.isqrt(n - 1) - 1) // 2 + 1):
+        if sieve[i]:
+            p = 2 * i + 1
+            # multiples p * p, p * p + 2p, ... are crossed out with one slice assignment
+            start = p * p // 2
+            sieve[start::p] = bytes(len(range(start, len(sieve), p)))
+    return [2] + list(compress(range(1, 2 * len(sieve), 2), sieve))
+
+
+def _segmented_sieve(lo, hi, base):
+    """ Odd primes in [lo, hi) (lo is odd), base - all primes below sqrt(hi)
+
+    Only one segment of SEGMENT numbers is kept in memory at a time.
+    """
+    res = []
+    base = base[1:]     # 2 is skipped together with all even numbers
+    for seg_lo in range(lo, hi, SEGMENT):
+        seg_hi = min(seg_lo + SEGMENT, hi)
+        size = (seg_hi - seg_lo + 1) // 2       # byte i stands for seg_lo + 2 * i
+        sieve = bytearray([1]) * size
+        for p in base:
+            if p * p >= seg_hi:
+                break
+            start = max(p * p, (seg_lo + p - 1) // p * p)
+            if start % 2 == 0:
+                start += p
+            i = (start - seg_lo) // 2
+            if i < size:
+                sieve[i::p] = bytes(len(range(i, size, p)))
+        res += compress(range(seg_lo, seg_lo + 2 * size, 2), sieve)
+    return res
 
 
 def sieve_of_Eratosthenes(n):
     """ Finds all primes from 0 to n using Sieve of Eratosthenes algorithm
 
+    Results are cached: primes below the largest bound asked for so far are kept,
+    a larger bound sieves only the new range (segment by segment).
+
     :param n: upper bound for primes to be looked for
     :return: primes: list of primes
     """
-    lst_of_numbers = [True] * n
-    lst_of_numbers[0], lst_of_numbers[1] = False, False
-    for i in range(int(math.sqrt(n)) + 1):
-        if lst_of_numbers[i]:
-            for j in range(i ** 2, n, i):
-                lst_of_numbers[j] = False
-
-    primes = []
-    for i in range(len(lst_of_numbers)):
-        if lst_of_numbers[i]:
-            primes.append(i)
-    return primes
+    global _primes, _sieved
+    if n > _sieved:
+        if n <= SEGMENT:
+            _primes = _odd_sieve(n)
+        else:
+            # primes up to sqrt(n) (and at least up to SEGMENT) are needed to sieve the segments
+            base = sieve_of_Eratosthenes(max(math.isqrt(n) + 1, SEGMENT))
+            _primes += _segmented_sieve(_sieved | 1, n, base)
+        _sieved = n
+    return _primes[:bisect.bisect_left(_primes, n)]
 
 
 def float2bin(b: float):
@@ -50,3 +101,18 @@ def extract_constants():
     K = [int(float2bin(math.pow(n, 1 / 3)), 2) for n in prime_list[:64]]
     return H, K
 
+
+
+def test():
+    global _primes, _sieved
+    print(_odd_sieve(1000) == [n for n in range(2, 1000) if all(n % d for d in range(2, math.isqrt(n) + 1))])
+    top = 3 * SEGMENT + 12345
+    reference = _odd_sieve(top)
+    # the cache is reset before every order of calls: growing, shrinking and crossing SEGMENT
+    for bounds in ((100, top), (top, SEGMENT + 1, 100, top), (SEGMENT - 1, 2 * SEGMENT + 7, SEGMENT, top, 3)):
+        _primes, _sieved = [], 2
+        print(all(sieve_of_Eratosthenes(n) == reference[:bisect.bisect_left(reference, n)] for n in bounds))
+
+
+if __name__ == "__main__":
+    test()
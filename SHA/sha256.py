@@ -1,9 +1,33 @@
 import hashlib
 import hmac
+import timeit
+from struct import unpack_from
 from primes import extract_constants
 
+np = None   # NumPy is imported by the first call of sha256_many (see _load_numpy)
+_numpy_checked = False
+
 MOD = 0xffffffff  # 32-bit word
 BITS_IN_WORD = 32
+MANY_LANES = 1 << 14  # at most this many messages are hashed together by one pass of sha256_many
+
+# initial hash value: first 32 bits of the fractional parts of the square roots of the first 8 primes
+# round constants: first 32 bits of the fractional parts of the cube roots of the first 64 primes
+# (both are obtained by primes.extract_constants, see test())
+_H0 = (
+    0x6a09e667, 0xbb67ae85, 0x3c6ef372, 0xa54ff53a, 0x510e527f, 0x9b05688c, 0x1f83d9ab, 0x5be0cd19,
+)
+
+_K = (
+    0x428a2f98, 0x71374491, 0xb5c0fbcf, 0xe9b5dba5, 0x3956c25b, 0x59f111f1, 0x923f82a4, 0xab1c5ed5,
+    0xd807aa98, 0x12835b01, 0x243185be, 0x550c7dc3, 0x72be5d74, 0x80deb1fe, 0x9bdc06a7, 0xc19bf174,
+    0xe49b69c1, 0xefbe4786, 0x0fc19dc6, 0x240ca1cc, 0x2de92c6f, 0x4a7484aa, 0x5cb0a9dc, 0x76f988da,
+    0x983e5152, 0xa831c66d, 0xb00327c8, 0xbf597fc7, 0xc6e00bf3, 0xd5a79147, 0x06ca6351, 0x14292967,
+    0x27b70a85, 0x2e1b2138, 0x4d2c6dfc, 0x53380d13, 0x650a7354, 0x766a0abb, 0x81c2c92e, 0x92722c85,
+    0xa2bfe8a1, 0xa81a664b, 0xc24b8b70, 0xc76c51a3, 0xd192e819, 0xd6990624, 0xf40e3585, 0x106aa070,
+    0x19a4c116, 0x1e376c08, 0x2748774c, 0x34b0bcb5, 0x391c0cb3, 0x4ed8aa4a, 0x5b9cca4f, 0x682e6ff3,
+    0x748f82ee, 0x78a5636f, 0x84c87814, 0x8cc70208, 0x90befffa, 0xa4506ceb, 0xbef9a3f7, 0xc67178f2,
+)
 
 
 def _rotr(x, y):
@@ -54,10 +78,11 @@ def _split_to_words(sentence):
         sentence[i + 3] << 0]) for i in range(0, len(sentence), 4)]
 
 
-def _padding(w):
+def _padding(w, n=None):
     """ Pad w according to the standard
 
     :param w: binary string to be padded
+    :param n: length of the whole message in bytes, if w is only its unprocessed tail (len(w) by default)
     :return: padded w
 
         we need to make w of 512 bits
@@ -65,49 +90,157 @@ def _padding(w):
         where number of 0s: 512 - 65 - |binary(w)|  (mod 512)
         and binary(length(w)) takes the last 64 bits
     """
-
-    n = len(w)
+    if n is None:
+        n = len(w)
     # 128 = 0b10000000
     w += (128).to_bytes(1, 'big') + (0).to_bytes(1, 'big') * ((64 - 9 - n) % 64) + (n * 8).to_bytes(8, 'big')
     return w
 
 
+def _compress_simple(hash_v, block):
+    """ SHA-256 compression function, straightforward version (see _compress)
+
+    :param hash_v: chaining value H_(i-1) (8 words)
+    :param block: 64-byte message block M_i
+    :return: H_i
+    """
+    words = _split_to_words(block)
+    for j in range(16, 64):
+        words.append((words[j - 16] + _s0(words[j - 15]) + words[j - 7] + _s1(words[j - 2])) & MOD)
+
+    a, b, c, d, e, f, g, h = hash_v
+    for j in range(0, 64):
+        t2 = (_sigma0(a) + _maj(a, b, c)) & MOD
+        t1 = (h + _sigma1(e) + _ch(e, f, g) + _K[j] + words[j]) & MOD
+
+        h, g, f, e, d, c, b, a = g, f, e, (d + t1) & MOD, c, b, a, (t2 + t1) & MOD
+
+    return [(x + y) & MOD for x, y, in zip([a, b, c, d, e, f, g, h], hash_v)]
+
+
+def _compress(hash_v, block, offset=0):
+    """ SHA-256 compression function, the same as _compress_simple, but:
+     - rotations and logical functions are inlined, constants are local variables
+     - words are unpacked with struct directly from the buffer (no slicing of the block)
+     - rounds are unrolled by 8: instead of shifting all 8 variables every round,
+       names of the variables are rotated (a new value is written only to d and h)
+     - results of rotations are not reduced modulo 2 ** 32: extra high bits don't affect
+       the low 32 bits of the sums, which are reduced once
+
+    ch(e, f, g) = g ^ (e & (f ^ g)),  maj(a, b, c) = (a & b) | (c & (a | b))
+
+    :param hash_v: chaining value H_(i-1) (8 words)
+    :param block: buffer with the message block M_i
+    :param offset: position of M_i in block
+    :return: H_i
+    """
+    w = [0] * 64
+    w[:16] = unpack_from('>16I', block, offset)
+    for j in range(16, 64):
+        x = w[j - 15]
+        y = w[j - 2]
+        w[j] = (w[j - 16] + ((x >> 7 | x << 25) ^ (x >> 18 | x << 14) ^ (x >> 3)) + w[j - 7] +
+                ((y >> 17 | y << 15) ^ (y >> 19 | y << 13) ^ (y >> 10))) & MOD
+
+    a, b, c, d, e, f, g, h = hash_v
+    k = _K
+    for j in range(0, 64, 8):
+        # round j
+        t1 = h + ((e >> 6 | e << 26) ^ (e >> 11 | e << 21) ^ (e >> 25 | e << 7)) + (g ^ (e & (f ^ g))) + k[j] + w[j]
+        d = (d + t1) & MOD
+        h = (t1 + ((a >> 2 | a << 30) ^ (a >> 13 | a << 19) ^ (a >> 22 | a << 10)) + ((a & b) | (c & (a | b)))) & MOD
+        # round j + 1
+        t1 = g + ((d >> 6 | d << 26) ^ (d >> 11 | d << 21) ^ (d >> 25 | d << 7)) + (f ^ (d & (e ^ f))) + k[j + 1] + w[j + 1]
+        c = (c + t1) & MOD
+        g = (t1 + ((h >> 2 | h << 30) ^ (h >> 13 | h << 19) ^ (h >> 22 | h << 10)) + ((h & a) | (b & (h | a)))) & MOD
+        # round j + 2
+        t1 = f + ((c >> 6 | c << 26) ^ (c >> 11 | c << 21) ^ (c >> 25 | c << 7)) + (e ^ (c & (d ^ e))) + k[j + 2] + w[j + 2]
+        b = (b + t1) & MOD
+        f = (t1 + ((g >> 2 | g << 30) ^ (g >> 13 | g << 19) ^ (g >> 22 | g << 10)) + ((g & h) | (a & (g | h)))) & MOD
+        # round j + 3
+        t1 = e + ((b >> 6 | b << 26) ^ (b >> 11 | b << 21) ^ (b >> 25 | b << 7)) + (d ^ (b & (c ^ d))) + k[j + 3] + w[j + 3]
+        a = (a + t1) & MOD
+        e = (t1 + ((f >> 2 | f << 30) ^ (f >> 13 | f << 19) ^ (f >> 22 | f << 10)) + ((f & g) | (h & (f | g)))) & MOD
+        # round j + 4
+        t1 = d + ((a >> 6 | a << 26) ^ (a >> 11 | a << 21) ^ (a >> 25 | a << 7)) + (c ^ (a & (b ^ c))) + k[j + 4] + w[j + 4]
+        h = (h + t1) & MOD
+        d = (t1 + ((e >> 2 | e << 30) ^ (e >> 13 | e << 19) ^ (e >> 22 | e << 10)) + ((e & f) | (g & (e | f)))) & MOD
+        # round j + 5
+        t1 = c + ((h >> 6 | h << 26) ^ (h >> 11 | h << 21) ^ (h >> 25 | h << 7)) + (b ^ (h & (a ^ b))) + k[j + 5] + w[j + 5]
+        g = (g + t1) & MOD
+        c = (t1 + ((d >> 2 | d << 30) ^ (d >> 13 | d << 19) ^ (d >> 22 | d << 10)) + ((d & e) | (f & (d | e)))) & MOD
+        # round j + 6
+        t1 = b + ((g >> 6 | g << 26) ^ (g >> 11 | g << 21) ^ (g >> 25 | g << 7)) + (a ^ (g & (h ^ a))) + k[j + 6] + w[j + 6]
+        f = (f + t1) & MOD
+        b = (t1 + ((c >> 2 | c << 30) ^ (c >> 13 | c << 19) ^ (c >> 22 | c << 10)) + ((c & d) | (e & (c | d)))) & MOD
+        # round j + 7
+        t1 = a + ((f >> 6 | f << 26) ^ (f >> 11 | f << 21) ^ (f >> 25 | f << 7)) + (h ^ (f & (g ^ h))) + k[j + 7] + w[j + 7]
+        e = (e + t1) & MOD
+        a = (t1 + ((b >> 2 | b << 30) ^ (b >> 13 | b << 19) ^ (b >> 22 | b << 10)) + ((b & c) | (d & (b | c)))) & MOD
+
+    return ((hash_v[0] + a) & MOD, (hash_v[1] + b) & MOD, (hash_v[2] + c) & MOD, (hash_v[3] + d) & MOD,
+            (hash_v[4] + e) & MOD, (hash_v[5] + f) & MOD, (hash_v[6] + g) & MOD, (hash_v[7] + h) & MOD)
+
+
 class SHA256:
     """ Cryptographic hash-function SHA-256
 
-    The message to be hashed is first
+    The message to be hashed is first
     (1) padded with its length in such a way that the result is a multiple of 512 bits long, and then
     (2) parsed into 512-bit message blocks M_1; M_2; ...; M_n
-     The message blocks are processed one at a time: Beginning with a fixed initial hash value H(0),
+     The message blocks are processed one at a time: Beginning with a fixed initial hash value H(0),
      sequentially compute H_i = H_(i-1) + C_M(i)(H_(i-1));
      where C is the SHA-256 compression function and + means word-wise mod 2^32 addition.
      H_N is the hash of M
+
+    Blocks are compressed as soon as update() gets them, so the object keeps only
+    the chaining value, less than one block of unprocessed data and the length of the message.
     """
 
-    def __init__(self, message):
-        self.message = message
-        self.H, self.K = extract_constants()  # initial hash value and other constants
+    def __init__(self, message=b''):
+        self._hash = _H0         # chaining value H_i
+        self._buffer = b''       # unprocessed tail of the message (less than 64 bytes)
+        self._length = 0         # length of the message in bytes
+        self.update(message)
 
     def update(self, m):
-        self.message += m
+        m = memoryview(m).cast('B')
+        self._length += len(m)
+        hash_v, i = self._hash, 0
+        if self._buffer:
+            # complete the buffered block first
+            i = min(64 - len(self._buffer), len(m))
+            self._buffer += m[:i].tobytes()
+            if len(self._buffer) < 64:
+                return
+            hash_v = _compress(hash_v, self._buffer)
+        n = len(m) - (len(m) - i) % 64
+        for j in range(i, n, 64):
+            hash_v = _compress(hash_v, m, j)
+        self._hash = hash_v
+        self._buffer = m[n:].tobytes()
+
+    @property
+    def state(self):
+        """
+        Chaining value after the whole blocks passed so far (8 words), e.g. a midstate to continue with compress()
+        """
+        return self._hash
+
+    def copy(self):
+        """
+        Return a copy of the hash object (e.g. to get digests of several messages with the same prefix)
+        """
+        other = SHA256.__new__(SHA256)
+        other._hash, other._buffer, other._length = self._hash, self._buffer, self._length
+        return other
 
     def _digest(self):
-        message = _padding(self.message)
-        hash_v = self.H
-        for i in range(0, len(message), 64):
-            m = message[i:i + 64]
-            words = _split_to_words(m)
-            for j in range(16, 64):
-                words.append((words[j - 16] + _s0(words[j - 15]) + words[j - 7] + _s1(words[j - 2])) & MOD)
-
-            a, b, c, d, e, f, g, h = hash_v
-            for j in range(0, 64):
-                t2 = (_sigma0(a) + _maj(a, b, c)) & MOD
-                t1 = (h + _sigma1(e) + _ch(e, f, g) + self.K[j] + words[j]) & MOD
-
-                h, g, f, e, d, c, b, a = g, f, e, (d + t1) & MOD, c, b, a, (t2 + t1) & MOD
-
-            hash_v = [(x + y) & MOD for x, y, in zip([a, b, c, d, e, f, g, h], hash_v)]
+        # state of the object itself is not changed, so update() can be called after digest()
+        tail = _padding(self._buffer, self._length)
+        hash_v = self._hash
+        for i in range(0, len(tail), 64):
+            hash_v = _compress(hash_v, tail, i)
         return hash_v
 
     def digest(self):
@@ -131,6 +264,83 @@ class SHA256:
         return ''.join(['0' * (10 - len(hex(h))) + hex(h)[2:] for h in hash_v])
 
 
+# public name of the compression function: compress(state, block, offset=0) -> next state
+compress = _compress
+
+
+def _load_numpy():
+    """
+    import NumPy on the first call (importing it takes much longer than the whole sha256 module)
+    :return: True if multi-buffer hashing is available
+    """
+    global np, _numpy_checked
+    if not _numpy_checked:
+        try:
+            import numpy
+            np = numpy
+        except ImportError:     # sha256_many falls back to SHA256 one message at a time
+            pass
+        _numpy_checked = True
+    return np is not None
+
+
+def _compress_np(hash_v, block):
+    """ SHA-256 compression function applied to many independent messages at once
+    (the same operations as _compress_simple, every variable holds one word of each message)
+
+    :param hash_v: (8, lanes) uint32 array - chaining values
+    :param block: (lanes, 16) uint32 array - one block of each message
+    :return: (8, lanes) uint32 array - new chaining values
+    """
+    def rotr(x, y):
+        return (x >> y) | (x << (BITS_IN_WORD - y))
+
+    words = list(np.ascontiguousarray(block.T))
+    for j in range(16, 64):
+        x, y = words[j - 15], words[j - 2]
+        words.append(words[j - 16] + (rotr(x, 7) ^ rotr(x, 18) ^ (x >> 3)) +
+                     words[j - 7] + (rotr(y, 17) ^ rotr(y, 19) ^ (y >> 10)))
+
+    a, b, c, d, e, f, g, h = hash_v
+    for j in range(64):
+        t1 = h + (rotr(e, 6) ^ rotr(e, 11) ^ rotr(e, 25)) + (g ^ (e & (f ^ g))) + _K[j] + words[j]
+        t2 = (rotr(a, 2) ^ rotr(a, 13) ^ rotr(a, 22)) + ((a & b) | (c & (a | b)))
+        h, g, f, e, d, c, b, a = g, f, e, d + t1, c, b, a, t1 + t2
+    # uint32 arithmetic is already modulo 2 ** 32
+    return hash_v + np.stack([a, b, c, d, e, f, g, h])
+
+
+def sha256_many(messages):
+    """ SHA-256 of many independent messages (multi-buffer hashing)
+
+    Messages are grouped by the number of blocks after padding, and every group is hashed
+    with all its messages in parallel: each word of the state is a NumPy array with one lane per message.
+
+    :param messages: iterable of bytes-like objects
+    :return: list of digests, the same as [SHA256(m).digest() for m in messages]
+    """
+    messages = [bytes(m) for m in messages]
+    if not _load_numpy():
+        return [SHA256(m).digest() for m in messages]
+    groups = {}   # number of blocks after padding -> indices of messages
+    for i, m in enumerate(messages):
+        groups.setdefault((len(m) + 72) // 64, []).append(i)
+
+    res = [None] * len(messages)
+    for n_blocks, indices in groups.items():
+        for start in range(0, len(indices), MANY_LANES):
+            lanes = indices[start:start + MANY_LANES]
+            data = b''.join(_padding(messages[i]) for i in lanes)
+            blocks = np.frombuffer(data, dtype='>u4').astype(np.uint32).reshape(len(lanes), n_blocks, 16)
+            hash_v = np.repeat(np.array(_H0, dtype=np.uint32)[:, None], len(lanes), axis=1)
+            for j in range(n_blocks):
+                hash_v = _compress_np(hash_v, blocks[:, j])
+            digests = hash_v.T.astype('>u4').tobytes()
+            for j, i in enumerate(lanes):
+                res[i] = digests[32 * j:32 * (j + 1)]
+    return res
+
+
 def generate_key(key):
     """ Generates key for AES-128
     :param key: any bytes object
@@ -140,6 +350,8 @@ def generate_key(key):
 
 
 def test():
+    print(extract_constants() == (list(_H0), list(_K)))
+
     message = "abc".encode('utf-8')
     print(hashlib.sha256(message).digest() == SHA256(message).digest())
     print(hashlib.sha256(message).hexdigest() == SHA256(message).hexdigest())
@@ -158,6 +370,68 @@ def test():
 
     print(generate_key('meow'.encode('utf-8')))
 
+    # update() with random chunks across block boundaries, copy() of a partly hashed message
+    import random
+    message = bytes(random.getrandbits(8) for _ in range(1000))
+    ok = True
+    for _ in range(20):
+        h, i = SHA256(), 0
+        while i < len(message):
+            n = random.choice((1, 7, 55, 63, 64, 65, 130))
+            h.update(bytearray(message[i:i + n]))
+            i += n
+            other = h.copy()
+            other.update(message[i:])
+            ok &= other.digest() == hashlib.sha256(message).digest()
+            ok &= h.hexdigest() == hashlib.sha256(message[:i]).hexdigest()
+        ok &= h.digest() == hashlib.sha256(message).digest()
+    print(ok)
+
+    messages = [('abc' * i).encode('utf-8') for i in range(100)]
+    print(sha256_many(messages) == [hashlib.sha256(m).digest() for m in messages])
+
+
+def benchmark_throughput(size=1 << 18):
+    """
+    Hashing speed in MB/s: _compress_simple, _compress (used by SHA256) and hashlib
+    """
+    message = bytes(size)
+
+    def simple():
+        hash_v = _H0
+        for i in range(0, size, 64):
+            hash_v = _compress_simple(hash_v, message[i:i + 64])
+
+    for name, f in (('simple compression', simple),
+                    ('SHA256', lambda: SHA256(message).digest()),
+                    ('hashlib', lambda: hashlib.sha256(message).digest())):
+        print('%-20s %10.2f MB/s' % (name, size / 2 ** 20 / timeit.timeit(f, number=1)))
+
+
+def benchmark_many(count=10000, size=32):
+    """
+    Hashes per second of sha256_many compared with SHA256 one message at a time
+    """
+    messages = [i.to_bytes(size, 'big') for i in range(count)]
+    one = count / timeit.timeit(lambda: [SHA256(m).digest() for m in messages], number=1)
+    many = count / timeit.timeit(lambda: sha256_many(messages), number=1)
+    print('SHA256:      %10.0f hashes/s' % one)
+    print('sha256_many: %10.0f hashes/s' % many)
+
+
+def benchmark(number=2000):
+    """
+    Number of hashes per second for short messages (compared with hashlib)
+    """
+    for size in (0, 16, 55, 64):
+        message = b'a' * size
+        own = number / timeit.timeit(lambda: SHA256(message).digest(), number=number)
+        ref = number / timeit.timeit(lambda: hashlib.sha256(message).digest(), number=number)
+        print('%2d bytes: %10.0f hashes/s  (hashlib: %10.0f hashes/s)' % (size, own, ref))
+
 
 if __name__ == "__main__":
     test()
+    benchmark()
+    benchmark_throughput()
+    benchmark_many()